@@ -0,0 +1,51 @@
+import asyncio
+
+from cache import LRUCache
+
+
+class ChatAdminCache:
+    """قوائم مشرفي تيليجرام لكل مجموعة، تُجلب مرة واحدة بـ get_chat_administrators
+    وتبقى صالحة حتى انتهاء مدتها أو وصول تحديث ChatMemberUpdated."""
+
+    def __init__(self, ttl=600.0, maxsize=4096):
+        self._cache = LRUCache(maxsize=maxsize, ttl=ttl)
+        # طلبات الجلب الجارية حتى لا تُرسل عدة طلبات لنفس المجموعة في وقت واحد
+        self._loading = {}
+
+    async def get_admin_ids(self, bot, chat_id):
+        """معرفات مشرفي المجموعة (بما فيهم المالك) كـ frozenset"""
+        admins = self._cache.get(chat_id)
+        if admins is not None:
+            return admins
+
+        pending = self._loading.get(chat_id)
+        if pending is not None:
+            return await asyncio.shield(pending)
+
+        pending = asyncio.get_running_loop().create_future()
+        self._loading[chat_id] = pending
+        try:
+            generation = self._cache.generation
+            members = await bot.get_chat_administrators(chat_id)
+            admins = frozenset(member.user.id for member in members)
+            self._cache.set(chat_id, admins, generation)
+            pending.set_result(admins)
+            return admins
+        except BaseException as exc:
+            pending.set_exception(exc)
+            pending.exception()  # حتى لا يُسجل تحذير إذا لم ينتظر أحد هذا الطلب
+            raise
+        finally:
+            del self._loading[chat_id]
+
+    def invalidate(self, chat_id):
+        self._cache.invalidate(chat_id)
+
+    def items(self):
+        return self._cache.items()
+
+    def load(self, items):
+        self._cache.load(items)
+
+    def stats(self):
+        return self._cache.stats()
@@ -0,0 +1,95 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from replies import GLOBAL_CHAT_ID, NOT_LOADED
+
+
+class AsyncDatabase:
+    """واجهة غير متزامنة فوق Database حتى لا يوقف SQLite حلقة أحداث البوت.
+
+    جميع الكتابات تمر عبر خيط كتابة واحد (بالترتيب)، والقراءات تُوزع على
+    مجموعة صغيرة من الخيوط لكل منها اتصال قراءة خاص (وضع WAL).
+    """
+
+    # الدوال التي لا تكتب في قاعدة البيانات وتعمل على اتصالات القراءة
+    READ_METHODS = frozenset({
+        'get_group_settings',
+        'is_leave_message_enabled',
+        'get_forbidden_matcher',
+        'get_forbidden_words',
+        'get_custom_reply',
+        'get_global_reply',
+        'get_user_ranks',
+        'is_vip',
+        'is_admin',
+        'is_owner',
+        'get_expiring_punishments',
+        'get_current_punishments',
+        'get_message_count',
+        'get_warnings',
+        'get_top_users',
+        'get_counters',
+        'get_total_users',
+        'cache_stats',
+    })
+
+    def __init__(self, db, readers=4, metrics=None):
+        self.db = db
+        # metrics: مقاييس زمن وأخطاء كل دالة وعدد استعلامات SQLite (انظر metrics.Metrics)
+        self._metrics = metrics
+        if metrics is not None:
+            db.set_trace_callback(metrics.sqlite_trace)
+        self._loaders = {}
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db-writer')
+        self._readers = ThreadPoolExecutor(max_workers=readers, thread_name_prefix='db-reader',
+                                           initializer=db.open_reader)
+
+    def __getattr__(self, name):
+        attr = getattr(self.db, name)
+        if name.startswith('_') or not callable(attr):
+            return attr
+        call = self._wrap(name, attr)
+        # حفظ الدالة المغلفة حتى لا يُعاد إنشاؤها في كل استدعاء
+        setattr(self, name, call)
+        return call
+
+    def _wrap(self, name, attr):
+        executor = self._readers if name in self.READ_METHODS else self._writer
+
+        @functools.wraps(attr)
+        async def call(*args, **kwargs):
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(executor, functools.partial(attr, *args, **kwargs))
+
+        if self._metrics is not None:
+            call = self._metrics.instrument(call, name, self._metrics.db, self._metrics.db_errors)
+        return call
+
+    # الردود تُقرأ مباشرة من الفهرس في الذاكرة دون المرور بخيوط القراءة، فالرد العام
+    # الشائع يُخدم لكل المجموعات من نسخة واحدة؛ خيط القراءة فقط عند أول تحميل
+
+    async def get_custom_reply(self, chat_id, keyword):
+        reply = self.db.peek_reply(chat_id, keyword)
+        if reply is NOT_LOADED:
+            return await self._loader('get_custom_reply')(chat_id, keyword)
+        return reply
+
+    async def get_global_reply(self, keyword):
+        reply = self.db.peek_reply(GLOBAL_CHAT_ID, keyword)
+        if reply is NOT_LOADED:
+            return await self._loader('get_global_reply')(keyword)
+        return reply
+
+    def _loader(self, name):
+        call = self._loaders.get(name)
+        if call is None:
+            call = self._loaders[name] = self._wrap(name, getattr(self.db, name))
+        return call
+
+    async def close(self):
+        """انتظار انتهاء القراءات ثم كتابة البيانات المؤجلة وإغلاق الاتصال"""
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, functools.partial(self._readers.shutdown, wait=True))
+        await loop.run_in_executor(self._writer, self.db.close)
+        self._writer.shutdown(wait=True)
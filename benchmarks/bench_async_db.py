@@ -0,0 +1,115 @@
+"""اختبار حمل: زمن استجابة المعالجات (p50/p99) أثناء كتابات متزامنة،
+قبل (استدعاء Database مباشرة داخل حلقة الأحداث) وبعد (AsyncDatabase).
+
+التشغيل: python benchmarks/bench_async_db.py [--seconds 3] [--rate 1000]
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from async_db import AsyncDatabase  # noqa: E402
+from database import Database  # noqa: E402
+
+CHATS = 50
+USERS = 2000
+BIG_CHAT = -1
+
+
+def seed(db):
+    """مجموعة كبيرة حتى يكون استعلام التوب بطيئًا كما في المجموعات المزدحمة"""
+    db.cursor.executemany(
+        "INSERT OR IGNORE INTO users_stats (chat_id, user_id, message_count) VALUES (?, ?, ?)",
+        [(BIG_CHAT, user_id, random.randint(0, 10000)) for user_id in range(100000)],
+    )
+    db.conn.commit()
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+async def handler(db, is_async, rng):
+    """معالج نموذجي: قراءة، وأحيانًا كتابة (إنذار) أو استعلام توب ثقيل.
+    يعيد True إذا كان المعالج خفيفًا (لا يشمل استعلام التوب)"""
+    chat_id = rng.randrange(CHATS)
+    user_id = rng.randrange(USERS)
+    roll = rng.random()
+    if is_async:
+        await db.get_warnings(chat_id, user_id)
+        if roll < 0.3:
+            await db.add_warning(chat_id, user_id)
+        elif roll < 0.31:
+            await db.get_top_users(BIG_CHAT)
+    else:
+        db.get_warnings(chat_id, user_id)
+        if roll < 0.3:
+            db.add_warning(chat_id, user_id)
+        elif roll < 0.31:
+            db.get_top_users(BIG_CHAT)
+    return not 0.3 <= roll < 0.31
+
+
+async def run(db, is_async, seconds, rate):
+    """إرسال التحديثات بمعدل ثابت وقياس الزمن من لحظة وصول كل تحديث حتى انتهاء معالجته،
+    فيدخل في القياس انتظار التحديث لدوره إذا كانت حلقة الأحداث متوقفة"""
+    rng = random.Random(1)
+    latencies = {True: [], False: []}
+    tasks = []
+
+    async def one(scheduled):
+        light = await handler(db, is_async, rng)
+        latencies[light].append(time.perf_counter() - scheduled)
+
+    interval = 1 / rate
+    deadline = time.perf_counter() + seconds
+    scheduled = time.perf_counter()
+    while scheduled < deadline:
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.ensure_future(one(scheduled)))
+        scheduled += interval
+
+    await asyncio.gather(*tasks)
+    return latencies
+
+
+def report(label, latencies):
+    # المهم هو المعالجات الخفيفة: هل يتأخر الجميع بسبب استعلام أو كتابة بطيئة لمجموعة أخرى؟
+    for light, name in ((True, 'light handlers'), (False, 'heavy handlers')):
+        ms = [value * 1000 for value in latencies[light]]
+        if ms:
+            print(f"{label:<24} {name:<15} n={len(ms):<6} p50={percentile(ms, 50):8.2f}ms "
+                  f"p99={percentile(ms, 99):8.2f}ms max={max(ms):8.2f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--seconds', type=float, default=3.0)
+    parser.add_argument('--rate', type=int, default=1000, help='تحديثات في الثانية')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, 'bench.db'))
+        seed(db)
+        report('before (sync on loop)', asyncio.run(run(db, False, args.seconds, args.rate)))
+
+        async def after():
+            adb = AsyncDatabase(db)
+            try:
+                return await run(adb, True, args.seconds, args.rate)
+            finally:
+                await adb.close()
+
+        report('after (AsyncDatabase)', asyncio.run(after()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""مقارنة توجيه الأوامر العربية: تعابير نمطية متتالية مقابل CommandRouter،
+على خليط واقعي من رسائل الدردشة (الغالبية) والأوامر.
+
+التشغيل: python benchmarks/bench_commands.py [--command-ratio 0.05]
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from commands import ADMIN, CommandRouter  # noqa: E402
+
+LOCK_NAMES = ('الروابط', 'الصور', 'المتحركات', 'الملصقات', 'التوجيه')
+PHRASES = (
+    [f'قفل {name}' for name in LOCK_NAMES]
+    + [f'فتح {name}' for name in LOCK_NAMES]
+    + ['تفعيل كتم الجدد', 'تعطيل كتم الجدد', 'تفعيل المغادرة', 'تعطيل المغادرة',
+       'مسح الكلمات الممنوعة', 'اضف رد', 'اضف رد عام', 'اضف كلمة ممنوعة', 'الغاء']
+)
+CHAT = (
+    'السلام عليكم', 'هلا والله', 'شلونكم شباب', 'تمام الحمد لله', 'وين الناس',
+    'صباح الخير', 'ههههههه', 'مين جاي الليلة؟', 'الله يسعدكم', 'ok', 'اضف لي صديقي',
+    'قفل الباب قبل ما تطلع', 'فتح المحل الساعة كم؟',
+)
+MESSAGES = 20000
+
+
+def build_mix(ratio, rng):
+    return [rng.choice(PHRASES) if rng.random() < ratio else rng.choice(CHAT) for _ in range(MESSAGES)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--command-ratio', type=float, default=0.05)
+    args = parser.parse_args()
+
+    rng = random.Random(7)
+    mix = build_mix(args.command_ratio, rng)
+
+    patterns = [(re.compile(f'^{re.escape(phrase)}$'), phrase) for phrase in PHRASES]
+
+    def regex_dispatch(text):
+        for pattern, phrase in patterns:
+            if pattern.match(text):
+                return phrase
+        return None
+
+    router = CommandRouter()
+    for phrase in PHRASES:
+        router.register(phrase, phrase, ADMIN)
+
+    # التأكد من أن الطريقتين تعطيان النتيجة نفسها قبل القياس
+    for text in set(mix):
+        resolved = router.resolve(text)
+        assert regex_dispatch(text) == (resolved[0].callback if resolved else None), text
+
+    for label, dispatch in (('regex chain', regex_dispatch), ('CommandRouter', router.resolve)):
+        seconds = min(timeit.repeat(lambda: [dispatch(text) for text in mix], number=1, repeat=5))
+        print(f"{label:<14} {seconds / MESSAGES * 1e6:6.2f} us/msg  "
+              f"({len(PHRASES)} commands, {args.command_ratio:.0%} command traffic)")
+
+
+if __name__ == '__main__':
+    main()
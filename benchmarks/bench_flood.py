@@ -0,0 +1,65 @@
+"""قياس FloodDetector تحت سيل صناعي من الرسائل: زمن القرار وحجم الذاكرة.
+
+الوقت افتراضي (يُمرر لـ check) حتى يمكن محاكاة دقائق من الحركة بمعدل ثابت في ثوانٍ.
+التشغيل: python benchmarks/bench_flood.py [--rate 5000] [--seconds 120] [--users 50000]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flood import MUTE, OK, WARN, FloodDetector  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rate', type=int, default=5000, help='رسائل في الثانية')
+    parser.add_argument('--seconds', type=int, default=120, help='مدة المحاكاة (وقت افتراضي)')
+    parser.add_argument('--users', type=int, default=50000, help='عدد المرسلين النشطين')
+    parser.add_argument('--chats', type=int, default=500)
+    parser.add_argument('--flooders', type=float, default=0.01, help='نسبة المرسلين المزعجين')
+    args = parser.parse_args()
+
+    rng = random.Random(3)
+    senders = [(-1000000 - rng.randrange(args.chats), 10000 + i) for i in range(args.users)]
+    flooders = senders[:max(1, int(args.users * args.flooders))]
+
+    tracemalloc.start()
+    detector = FloodDetector()
+    decisions = {OK: 0, WARN: 0, MUTE: 0}
+    total = args.rate * args.seconds
+    step = 1.0 / args.rate
+
+    start = time.perf_counter()
+    now = 0.0
+    for _ in range(total):
+        # ربع الحركة من المزعجين، والباقي موزع على جميع الأعضاء
+        chat_id, user_id = rng.choice(flooders) if rng.random() < 0.25 else rng.choice(senders)
+        decisions[detector.check(chat_id, user_id, now)] += 1
+        now += step
+    elapsed = time.perf_counter() - start
+
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    # زمن القرار وحده بعد استبعاد توليد الأرقام العشوائية
+    sample = [rng.choice(senders) for _ in range(100000)]
+    t0 = time.perf_counter()
+    for chat_id, user_id in sample:
+        detector.check(chat_id, user_id, now)
+    per_check_us = (time.perf_counter() - t0) / len(sample) * 1e6
+
+    print(f"messages        {total} ({args.rate}/s for {args.seconds}s simulated, {elapsed:.2f}s wall)")
+    print(f"decision        {per_check_us:.2f} us/msg  (max sustainable ~{1e6 / per_check_us:,.0f} msgs/s)")
+    print(f"tracked senders {len(detector)}")
+    print(f"memory          {current / 1e6:.1f} MB current, {peak / 1e6:.1f} MB peak "
+          f"({current / max(1, len(detector)):.0f} B/sender)")
+    print(f"decisions       ok={decisions[OK]} warn={decisions[WARN]} mute={decisions[MUTE]}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+"""قياس تكلفة فحص الرسالة الواحدة مع نمو قائمة الكلمات الممنوعة.
+
+التشغيل: python benchmarks/bench_matcher.py
+"""
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from matcher import ForbiddenWordMatcher, normalize_arabic  # noqa: E402
+
+ARABIC_LETTERS = 'ابتثجحخدذرزسشصضطظعغفقكلمنهوي'
+SIZES = (10, 100, 1000, 10000)
+MESSAGES = 2000
+
+
+def random_word(rng, low=3, high=8):
+    return ''.join(rng.choice(ARABIC_LETTERS) for _ in range(rng.randint(low, high)))
+
+
+def random_message(rng):
+    return ' '.join(random_word(rng, 2, 7) for _ in range(rng.randint(3, 25)))
+
+
+def naive_search(words, text):
+    text = normalize_arabic(text)
+    for word in words:
+        if word in text:
+            return word
+    return None
+
+
+def main():
+    rng = random.Random(42)
+    messages = [random_message(rng) for _ in range(MESSAGES)]
+
+    print(f"{'words':>7} {'build ms':>10} {'matcher us/msg':>15} {'naive us/msg':>13}")
+    for size in SIZES:
+        words = [random_word(rng, 6, 10) for _ in range(size)]
+
+        start = timeit.default_timer()
+        matcher = ForbiddenWordMatcher(words)
+        build_ms = (timeit.default_timer() - start) * 1000
+
+        normalized = [normalize_arabic(word) for word in words]
+        matcher_us = min(timeit.repeat(lambda: [matcher.search(m) for m in messages], number=1, repeat=3)) / MESSAGES * 1e6
+        naive_us = min(timeit.repeat(lambda: [naive_search(normalized, m) for m in messages], number=1, repeat=3)) / MESSAGES * 1e6
+
+        print(f"{size:>7} {build_ms:>10.1f} {matcher_us:>15.2f} {naive_us:>13.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""التحقق من Outbox مقابل بوت وهمي يطبق حدود تيليجرام ويرفع RetryAfter عند تجاوزها.
+
+الحدود مضروبة في --scale (الافتراضي 10) حتى ينتهي الاختبار في ثوانٍ؛ المهم هو نسبة
+الإنتاجية إلى الحد وعدد أخطاء RetryAfter.
+التشغيل: python benchmarks/bench_outbox.py [--scale 10] [--chats 40] [--per-chat 30]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from collections import deque
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from outbox import COSMETIC, MODERATION, NORMAL, Outbox  # noqa: E402
+
+
+class StubRetryAfter(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f"Flood control exceeded. Retry in {retry_after} seconds")
+        self.retry_after = retry_after
+
+
+class StubBot:
+    """بوت محلي يسجل الرسائل ويطبق نافذة منزلقة للحد العام وحد كل مجموعة"""
+
+    def __init__(self, global_limit, chat_limit, chat_window):
+        self.global_limit = global_limit
+        self.chat_limit = chat_limit
+        self.chat_window = chat_window
+        self.global_log = deque()
+        self.chat_logs = {}
+        self.sent = []
+        self.retry_after_errors = 0
+
+    async def send_message(self, chat_id, text, **kwargs):
+        now = time.monotonic()
+        while self.global_log and self.global_log[0] <= now - 1:
+            self.global_log.popleft()
+        chat_log = self.chat_logs.setdefault(chat_id, deque())
+        while chat_log and chat_log[0] <= now - self.chat_window:
+            chat_log.popleft()
+        if len(self.global_log) >= self.global_limit or len(chat_log) >= self.chat_limit:
+            self.retry_after_errors += 1
+            raise StubRetryAfter(1)
+        self.global_log.append(now)
+        chat_log.append(now)
+        self.sent.append((now, chat_id, text))
+        await asyncio.sleep(0.002)  # زمن الشبكة التقريبي
+        return len(self.sent)
+
+
+async def run(args):
+    global_limit = 30 * args.scale
+    chat_window = 60 / args.scale
+    bot = StubBot(global_limit, 20, chat_window)
+    # نفس تقسيم الإعدادات الافتراضية (رصيد مبدئي + معدل = الحد) بعد ضربها في scale
+    global_burst = 5 * args.scale
+    outbox = Outbox(global_rate=global_limit - global_burst, global_burst=global_burst,
+                    per_chat_rate=17 / chat_window, per_chat_burst=3)
+    outbox.start(bot)
+
+    futures = []
+    priorities = (MODERATION, NORMAL, COSMETIC)
+    for i in range(args.per_chat):
+        for chat in range(args.chats):
+            chat_id = -1000 - chat
+            priority = priorities[(i + chat) % 3]
+            futures.append(outbox.send_message(chat_id, f"msg {i}", priority=priority))
+            # إشعارات المغادرة المتكررة تُدمج في رسالة واحدة لكل مجموعة
+            futures.append(outbox.send_message(chat_id, f"left {i}", priority=COSMETIC,
+                                               coalesce_key=('left', chat_id)))
+
+    start = time.monotonic()
+    await asyncio.gather(*futures, return_exceptions=True)
+    elapsed = time.monotonic() - start
+    await outbox.stop()
+
+    messages = len(bot.sent)
+    # الحد النظري: الأقل بين الحد العام وحدود جميع المجموعات معًا
+    limit = min(global_limit, args.chats * 20 / chat_window)
+    # أعلى معدل خلال أي ثانية (يجب ألا يتجاوز الحد العام)
+    peak, window = 0, deque()
+    for sent_at, *_ in bot.sent:
+        window.append(sent_at)
+        while window[0] <= sent_at - 1:
+            window.popleft()
+        peak = max(peak, len(window))
+
+    print(f"submitted      {len(futures)} calls ({outbox.coalesced} coalesced into {messages - args.chats * args.per_chat} leave notices)")
+    print(f"delivered      {messages} messages in {elapsed:.2f}s")
+    print(f"throughput     {messages / elapsed:.1f} msg/s (limit {limit:.1f} msg/s, {messages / elapsed / limit:.0%})")
+    print(f"peak 1s window {peak} (global limit {global_limit})")
+    print(f"RetryAfter     {bot.retry_after_errors}   retries {outbox.retries}   failed {outbox.failed}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scale', type=float, default=10)
+    parser.add_argument('--chats', type=int, default=40)
+    parser.add_argument('--per-chat', type=int, default=30)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,449 @@
+"""إعادة تشغيل تحديثات تيليجرام عبر التطبيق الحقيقي (نفس معالجات main) دون شبكة أو توكن.
+
+يبني التطبيق عبر main.build_application مع طبقة HTTP وهمية (StubRequest) تسجل الطلبات
+الصادرة وتعيد ردودًا صالحة، ثم يمرر التحديثات مباشرة إلى process_update بالترتيب كما
+يفعل الـ Webhook. قاعدة البيانات ملف مؤقت جديد ما لم يُحدد --db.
+
+يقيس: الإنتاجية، p50/p95/p99 لكل معالج ولكل مرحلة في MessagePipeline ولكل نوع تحديث،
+عدد استعلامات SQLite لكل تحديث، وأقصى RSS. حدود الإرسال في Outbox معطلة هنا (تقيسها
+bench_outbox.py) حتى لا تحجب زمن المعالجة.
+
+التحديثات إما مولدة (--updates-count و --mix) أو مسجلة (--updates ملف JSON lines، كل سطر
+Update كما يرسله تيليجرام أو {"kind": ..., "update": ...}). --dump يحفظ التحديثات المولدة
+لإعادتها كما هي. للمقارنة بين commit وآخر:
+
+    python benchmarks/bench_replay.py --output before.json
+    git checkout <other-commit>
+    python benchmarks/bench_replay.py --compare before.json
+
+--workers N يوزع التحديثات على N عملية حسب chat_id (كما في WORKERS=N) على قاعدة البيانات
+نفسها، ويقيس الإنتاجية الكلية لمقارنة التوسع مع عدد الأنوية (--workers 1 ثم 2 ثم 4).
+
+يتطلب python-telegram-bot[job-queue] (requirements.txt).
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from telegram import Update  # noqa: E402
+from telegram.ext import ConversationHandler  # noqa: E402
+from telegram.request import BaseRequest  # noqa: E402
+
+BOT_ID = 999000
+OWNER_ID = 1  # مالك كل مجموعة (يعيده getChatAdministrators) ومرسل أوامر المشرفين
+TOKEN = f"{BOT_ID}:BENCHMARK"
+FORBIDDEN_WORDS = ['كلمةممنوعة', 'رابط_مشبوه', 'spamword']
+CUSTOM_REPLY = ('مرحبا', {'type': 'text', 'text': 'أهلًا بك'})
+CHAT_TEXTS = ['السلام عليكم', 'كيف الحال', 'صباح الخير يا جماعة', 'مرحبا', 'هههههه',
+              'شكرًا لكم', 'أحد يعرف الجواب؟', 'تمام', 'ok', 'لا أعرف والله']
+COMMANDS = [('التوب', False), ('توب اليوم', False), ('توب الاسبوع', False),
+            ('قفل الروابط', True), ('فتح الروابط', True)]
+DEFAULT_MIX = 'chat=60,command=10,join=6,leave=4,media=10,forbidden=10'
+
+
+class StubRequest(BaseRequest):
+    """طبقة HTTP بديلة: تسجل كل استدعاء للـ Bot API وتعيد نتيجة صالحة دون اتصال."""
+
+    def __init__(self):
+        self.calls = Counter()
+        self._message_ids = itertools.count(1)
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        endpoint = url.rsplit('/', 1)[-1]
+        params = request_data.parameters if request_data is not None else {}
+        self.calls[endpoint] += 1
+        body = {'ok': True, 'result': self._result(endpoint, params)}
+        return 200, json.dumps(body).encode()
+
+    def _result(self, endpoint, params):
+        if endpoint == 'getMe':
+            return {'id': BOT_ID, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot',
+                    'can_join_groups': True, 'can_read_all_group_messages': True,
+                    'supports_inline_queries': False}
+        if endpoint == 'getChatAdministrators':
+            return [{'status': 'creator', 'is_anonymous': False,
+                     'user': {'id': OWNER_ID, 'is_bot': False, 'first_name': 'Owner'}}]
+        if endpoint.startswith('send'):
+            return {'message_id': next(self._message_ids), 'date': int(time.time()),
+                    'chat': {'id': params.get('chat_id'), 'type': 'supergroup'},
+                    'from': {'id': BOT_ID, 'is_bot': True, 'first_name': 'Bench'},
+                    'text': params.get('text', '')}
+        return True
+
+
+class QueryCounter:
+    """عداد استعلامات SQLite (يُستدعى من خيوط قاعدة البيانات)"""
+
+    def __init__(self):
+        self.total = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, sql):
+        with self._lock:
+            self.total += 1
+
+
+# ---------- التحديثات ----------
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        kind, _, weight = part.partition('=')
+        mix[kind.strip()] = float(weight)
+    return mix
+
+
+def generate_updates(count, mix, chats, users, seed):
+    rng = random.Random(seed)
+    kinds, weights = zip(*mix.items())
+    update_ids = itertools.count(1)
+    message_ids = itertools.count(1)
+    new_user_ids = itertools.count(10_000_000)
+    now = int(time.time())
+
+    def user(user_id):
+        return {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}'}
+
+    for _ in range(count):
+        kind = rng.choices(kinds, weights)[0]
+        chat_id = -1001000000000 - rng.randrange(chats)
+        sender = 100 + rng.randrange(users)
+        message = {'message_id': next(message_ids), 'date': now,
+                   'chat': {'id': chat_id, 'type': 'supergroup', 'title': f'Bench {chat_id}'}}
+        if kind == 'chat':
+            message['text'] = rng.choice(CHAT_TEXTS)
+        elif kind == 'command':
+            text, admin_only = rng.choice(COMMANDS)
+            sender = OWNER_ID if admin_only else sender
+            message['text'] = text
+        elif kind == 'forbidden':
+            message['text'] = f"{rng.choice(CHAT_TEXTS)} {rng.choice(FORBIDDEN_WORDS)}"
+        elif kind == 'media':
+            message['photo'] = [{'file_id': f'AgACAgQAAx{i}', 'file_unique_id': f'u{i}', 'width': w, 'height': w}
+                                for i, w in enumerate((90, 320, 800))]
+            message['caption'] = rng.choice(CHAT_TEXTS)
+        elif kind == 'join':
+            joined = [user(next(new_user_ids)) for _ in range(rng.choice((1, 1, 1, 2, 5)))]
+            message['new_chat_members'] = joined
+            sender = joined[0]['id']
+        elif kind == 'leave':
+            message['left_chat_member'] = user(sender)
+        else:
+            raise ValueError(f"unknown update kind in --mix: {kind}")
+        message['from'] = user(sender)
+        yield kind, {'update_id': next(update_ids), 'message': message}
+
+
+def classify(data):
+    message = data.get('message') or data.get('edited_message') or {}
+    if 'new_chat_members' in message:
+        return 'join'
+    if 'left_chat_member' in message:
+        return 'leave'
+    if any(key in message for key in ('photo', 'video', 'animation', 'voice', 'audio', 'document', 'sticker')):
+        return 'media'
+    if 'text' in message:
+        return 'text'
+    return next((key for key in data if key != 'update_id'), 'other')
+
+
+def load_updates(path):
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                data = json.loads(line)
+                if 'update' in data:
+                    yield data.get('kind') or classify(data['update']), data['update']
+                else:
+                    yield classify(data), data
+
+
+# ---------- القياس ----------
+
+def timed(name, callback, timings):
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await callback(*args, **kwargs)
+        finally:
+            timings[name].append(time.perf_counter() - start)
+    return wrapper
+
+
+def instrument(application, pipeline, timings):
+    """قياس زمن كل معالج (بما فيها معالجات المحادثات) وكل مرحلة في MessagePipeline"""
+    def wrap(handler):
+        if isinstance(handler, ConversationHandler):
+            for inner in handler.entry_points + handler.fallbacks + [h for hs in handler.states.values() for h in hs]:
+                wrap(inner)
+        elif getattr(handler, 'callback', None) is not None:
+            handler.callback = timed(f"handler:{handler.callback.__qualname__}", handler.callback, timings)
+
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            wrap(handler)
+    pipeline.instrument(lambda stage: timed(f"stage:{stage.__name__}", stage, timings))
+
+
+def percentiles(samples):
+    ordered = sorted(samples)
+
+    def pick(q):
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000
+
+    return {'count': len(ordered), 'p50': pick(0.50), 'p95': pick(0.95), 'p99': pick(0.99),
+            'mean': sum(ordered) / len(ordered) * 1000}
+
+
+def git_revision():
+    try:
+        rev = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                             text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=ROOT,
+                               capture_output=True, text=True).stdout.strip()
+        return rev + ('-dirty' if dirty else '')
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def replay(args, updates, barrier=None):
+    """تشغيل التحديثات في هذه العملية وإرجاع القياسات الخام (تُدمج عبر summarize)"""
+    import main
+    from outbox import Outbox
+
+    logging.disable(logging.INFO)  # main يضبط INFO؛ التحذيرات والأخطاء فقط أثناء القياس
+
+    # حدود الإرسال معطلة: المعالجات تُقاس دون انتظار نافذة تيليجرام
+    unlimited = float('inf')
+    main.outbox = Outbox(global_rate=unlimited, global_burst=unlimited, per_chat_rate=unlimited,
+                         per_chat_burst=unlimited, is_transient=main.is_transient_error)
+
+    stub = StubRequest()
+    application = main.build_application(TOKEN, request=stub)
+    timings = defaultdict(list)
+    instrument(application, main.pipeline, timings)
+    queries = QueryCounter()
+    main.db.db.set_trace_callback(queries)
+
+    await application.initialize()
+    await application.start()
+    await application.post_init(application)
+
+    chat_ids = {data['message']['chat']['id'] for _, data in updates if 'message' in data}
+    for chat_id in chat_ids:
+        await main.db.add_forbidden_words(chat_id, FORBIDDEN_WORDS)
+        await main.db.set_leave_message_status(chat_id, True)
+        await main.db.add_custom_reply(chat_id, *CUSTOM_REPLY)
+
+    async def run(batch):
+        kind_queries = Counter()
+        for kind, data in batch:
+            update = Update.de_json(data, application.bot)
+            before = queries.total
+            start = time.perf_counter()
+            await application.process_update(update)
+            timings[f"update:{kind}"].append(time.perf_counter() - start)
+            kind_queries[kind] += queries.total - before
+        return kind_queries
+
+    await run(updates[:args.warmup])
+    timings.clear()
+    stub.calls.clear()
+    measured = updates[args.warmup:]
+    if barrier is not None:
+        # جميع العمال يبدؤون القياس معًا
+        await asyncio.get_running_loop().run_in_executor(None, barrier.wait)
+    queries_before = queries.total
+
+    start = time.perf_counter()
+    kind_queries = await run(measured)
+    elapsed = time.perf_counter() - start
+    total_queries = queries.total - queries_before
+
+    await application.stop()
+    await application.post_stop(application)
+    await application.shutdown()
+    await application.post_shutdown(application)
+
+    return {
+        'updates': len(measured),
+        'elapsed_s': elapsed,
+        'timings': dict(timings),
+        'kinds': Counter(kind for kind, _ in measured),
+        'kind_queries': kind_queries,
+        'total_queries': total_queries,
+        # ru_maxrss بالكيلوبايت على Linux
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'calls': stub.calls,
+    }
+
+
+def _replay_shard(args, updates, index, count, barrier, results):
+    """نقطة دخول عملية عامل في --workers: نفس إعداد workers.worker_main ثم replay لمحادثاته فقط"""
+    import main
+    main.configure_worker(index, count)
+    results.put(asyncio.run(replay(args, updates, barrier)))
+
+
+def replay_sharded(args, updates):
+    """توزيع التحديثات على args.workers عملية حسب chat_id كما يفعل ShardedReceiver"""
+    from database import Database
+    from workers import shard_for, update_chat_id
+
+    # إنشاء المخطط وتطبيق الترحيلات مرة واحدة قبل أن تفتح العمليات الملف نفسه
+    Database(os.environ['DB_PATH']).close()
+    shards = [[] for _ in range(args.workers)]
+    for kind, data in updates:
+        shards[shard_for(update_chat_id(data), args.workers)].append((kind, data))
+
+    context = multiprocessing.get_context('spawn')
+    barrier = context.Barrier(args.workers)
+    results = context.Queue()
+    processes = [context.Process(target=_replay_shard, args=(args, shard, index, args.workers, barrier, results))
+                 for index, shard in enumerate(shards)]
+    for process in processes:
+        process.start()
+    raws = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    return raws
+
+
+def summarize(raws):
+    """دمج قياسات عامل واحد أو أكثر: الإنتاجية الكلية على أطول مدة، والنسب المئوية على جميع العينات"""
+    timings = defaultdict(list)
+    kinds, kind_queries, calls = Counter(), Counter(), Counter()
+    for raw in raws:
+        for name, samples in raw['timings'].items():
+            timings[name].extend(samples)
+        kinds.update(raw['kinds'])
+        kind_queries.update(raw['kind_queries'])
+        calls.update(raw['calls'])
+    updates = sum(raw['updates'] for raw in raws)
+    elapsed = max(raw['elapsed_s'] for raw in raws)
+    return {
+        'revision': git_revision(),
+        'workers': len(raws),
+        'updates': updates,
+        'elapsed_s': elapsed,
+        'throughput': updates / elapsed,
+        'worker_throughput': [raw['updates'] / raw['elapsed_s'] for raw in raws],
+        'latency_ms': {name: percentiles(samples) for name, samples in sorted(timings.items())},
+        'queries_per_update': dict(
+            {'all': sum(raw['total_queries'] for raw in raws) / max(1, updates)},
+            **{kind: kind_queries[kind] / kinds[kind] for kind in sorted(kinds)}
+        ),
+        # مجموع ذروات العمليات (الذاكرة الكلية المطلوبة)
+        'peak_rss_mb': sum(raw['peak_rss_mb'] for raw in raws),
+        'outgoing_calls': dict(calls.most_common()),
+    }
+
+
+# ---------- التقرير ----------
+
+def report(result):
+    print(f"revision      {result['revision']}")
+    print(f"updates       {result['updates']} in {result['elapsed_s']:.2f}s")
+    print(f"throughput    {result['throughput']:.1f} updates/s")
+    if result['workers'] > 1:
+        print(f"workers       {result['workers']}: " + "  ".join(f"{t:.1f}" for t in result['worker_throughput']) + " updates/s")
+    print(f"peak RSS      {result['peak_rss_mb']:.1f} MB")
+    print("queries/update " + "  ".join(f"{k}={v:.2f}" for k, v in result['queries_per_update'].items()))
+    print("outgoing      " + "  ".join(f"{k}={v}" for k, v in result['outgoing_calls'].items()))
+    print(f"\n{'latency (ms)':<40}{'count':>8}{'p50':>9}{'p95':>9}{'p99':>9}")
+    for name, stats in result['latency_ms'].items():
+        print(f"{name:<40}{stats['count']:>8}{stats['p50']:>9.3f}{stats['p95']:>9.3f}{stats['p99']:>9.3f}")
+
+
+def compare(old, new):
+    def row(name, before, after, lower_is_better=True):
+        change = (after - before) / before if before else 0.0
+        better = (change < 0) == lower_is_better
+        mark = '' if abs(change) < 0.05 else (' better' if better else ' WORSE')
+        print(f"{name:<44}{before:>10.3f}{after:>10.3f}{change:>+9.1%}{mark}")
+
+    print(f"\ncomparison {old.get('revision')} -> {new.get('revision')}")
+    print(f"{'metric':<44}{'before':>10}{'after':>10}{'change':>9}")
+    row('throughput (updates/s)', old['throughput'], new['throughput'], lower_is_better=False)
+    row('peak RSS (MB)', old['peak_rss_mb'], new['peak_rss_mb'])
+    for kind in sorted(set(old['queries_per_update']) & set(new['queries_per_update'])):
+        row(f'queries/update {kind}', old['queries_per_update'][kind], new['queries_per_update'][kind])
+    for name in sorted(set(old['latency_ms']) & set(new['latency_ms'])):
+        for q in ('p50', 'p99'):
+            row(f"{name} {q}", old['latency_ms'][name][q], new['latency_ms'][name][q])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--updates', help='ملف تحديثات مسجلة (JSON lines) بدل التوليد')
+    parser.add_argument('--updates-count', type=int, default=5000)
+    parser.add_argument('--mix', default=DEFAULT_MIX, help='أوزان أنواع التحديثات المولدة')
+    parser.add_argument('--chats', type=int, default=50)
+    parser.add_argument('--users', type=int, default=300, help='أعضاء نشطون لكل مجموعة')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--warmup', type=int, default=200, help='تحديثات أولى لا تدخل في القياس')
+    parser.add_argument('--db', help='ملف قاعدة البيانات (الافتراضي: ملف مؤقت جديد)')
+    parser.add_argument('--dump', help='حفظ التحديثات المولدة في ملف لإعادة تشغيلها')
+    parser.add_argument('--output', help='حفظ النتائج JSON للمقارنة لاحقًا')
+    parser.add_argument('--compare', help='نتائج سابقة (JSON) لمقارنتها بهذا التشغيل')
+    parser.add_argument('--workers', type=int, default=1, help='عدد العمليات (توزيع المحادثات حسب chat_id)')
+    args = parser.parse_args()
+
+    if args.updates:
+        updates = list(load_updates(args.updates))
+    else:
+        updates = list(generate_updates(args.updates_count + args.warmup, parse_mix(args.mix),
+                                        args.chats, args.users, args.seed))
+    if args.dump:
+        with open(args.dump, 'w', encoding='utf-8') as f:
+            for kind, data in updates:
+                f.write(json.dumps({'kind': kind, 'update': data}, ensure_ascii=False) + '\n')
+
+    # main يقرأ DB_PATH عند الاستيراد
+    tmpdir = tempfile.TemporaryDirectory()
+    os.environ['DB_PATH'] = args.db or os.path.join(tmpdir.name, 'bench.db')
+    # كل تشغيل يبدأ بذاكرة فارغة حتى تبقى النتائج قابلة للمقارنة (لا لقطة من تشغيل سابق)
+    os.environ['SNAPSHOT_PATH'] = ''
+
+    if args.workers > 1:
+        result = summarize(replay_sharded(args, updates))
+    else:
+        result = summarize([asyncio.run(replay(args, updates))])
+    report(result)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=1)
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            compare(json.load(f), result)
+    tmpdir.cleanup()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """ذاكرة مؤقتة محدودة الحجم (LRU) مع مدة صلاحية (TTL) لكل عنصر."""
+
+    _MISSING = object()
+
+    def __init__(self, maxsize=1024, ttl=300.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # يزداد مع كل حذف، حتى لا يُخزن قارئ قيمة قرأها قبل تعديل حدث أثناء قراءته
+        self.generation = 0
+
+    def get(self, key, default=None):
+        """إرجاع القيمة المخزنة أو default إذا لم تكن موجودة أو انتهت صلاحيتها"""
+        with self._lock:
+            entry = self._data.get(key, self._MISSING)
+            if entry is self._MISSING:
+                self.misses += 1
+                return default
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, generation=None, ttl=None):
+        """تخزين قيمة مع إخراج الأقدم استخدامًا عند امتلاء الذاكرة؛ ttl يتجاوز مدة الصلاحية الافتراضية"""
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        """حذف عنصر من الذاكرة (يُستدعى بعد أي تعديل في قاعدة البيانات)"""
+        with self._lock:
+            self._data.pop(key, None)
+            self.generation += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.generation += 1
+
+    def items(self):
+        """العناصر غير المنتهية [(key, value, وقت الانتهاء)] من الأقدم استخدامًا إلى الأحدث (لحفظها في
+        لقطة عند الإيقاف)؛ وقت الانتهاء بتوقيت time.time() لأن monotonic لا يصلح بين عمليتين"""
+        now = time.monotonic()
+        wall = time.time()
+        with self._lock:
+            return [(key, value, wall + expires_at - now) for key, (expires_at, value) in self._data.items() if expires_at >= now]
+
+    def load(self, items):
+        """تعبئة الذاكرة بعناصر items() بالترتيب نفسه؛ كل عنصر يحتفظ بما بقي من صلاحيته، فلا
+        تطيل إعادة التشغيل عمر قيمة قديمة"""
+        wall = time.time()
+        for key, value, expires_at in items:
+            if expires_at > wall:
+                self.set(key, value, ttl=expires_at - wall)
+
+    def stats(self):
+        """إحصائيات الاستخدام لضبط حجم الذاكرة حسب عدد المجموعات النشطة"""
+        with self._lock:
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+    def __len__(self):
+        return len(self._data)
@@ -0,0 +1,63 @@
+from matcher import normalize_arabic
+
+# مستويات الصلاحية بالترتيب: عضو، مشرف (رتبة مخصصة أو مشرف تيليجرام)، مطور البوت
+MEMBER, ADMIN, DEVELOPER = 'member', 'admin', 'developer'
+
+
+class Command:
+    """أمر عربي مسجل: العبارة، الدالة المنفذة، الصلاحية المطلوبة، وهل يقبل وسائط بعد العبارة."""
+
+    __slots__ = ('phrase', 'words', 'callback', 'permission', 'takes_args')
+
+    def __init__(self, phrase, callback, permission, takes_args):
+        self.phrase = phrase
+        self.words = tuple(normalize_arabic(word) for word in phrase.split())
+        self.callback = callback
+        self.permission = permission
+        self.takes_args = takes_args
+
+
+class CommandRouter:
+    """موجه الأوامر العربية: بحث واحد في جدول مفتاحه أول كلمة من الأمر.
+
+    معظم الرسائل ليست أوامر، ويكفي لرفضها فصل الكلمة الأولى والبحث عنها في القاموس.
+    """
+
+    def __init__(self):
+        # الكلمة الأولى -> الأوامر التي تبدأ بها، الأطول أولًا حتى يُفضل "اضف رد عام" على "اضف رد"
+        self._by_first_word = {}
+        self._max_words = 0
+
+    def register(self, phrase, callback, permission=MEMBER, takes_args=False):
+        command = Command(phrase, callback, permission, takes_args)
+        commands = self._by_first_word.setdefault(command.words[0], [])
+        commands.append(command)
+        commands.sort(key=lambda c: len(c.words), reverse=True)
+        self._max_words = max(self._max_words, len(command.words))
+        return command
+
+    def resolve(self, text):
+        """إرجاع (الأمر، قائمة الوسائط) للنص، أو None إذا لم يكن أمرًا.
+        الوسائط تُعاد كما كتبها العضو دون توحيد."""
+        first = text.split(None, 1)
+        if not first:
+            return None
+        commands = self._by_first_word.get(normalize_arabic(first[0]))
+        if commands is None:
+            return None
+
+        words = text.split()
+        normalized = tuple(normalize_arabic(word) for word in words[:self._max_words])
+        for command in commands:
+            size = len(command.words)
+            if normalized[:size] != command.words:
+                continue
+            if len(words) == size:
+                return command, []
+            if command.takes_args:
+                return command, words[size:]
+        return None
+
+    def __iter__(self):
+        for commands in self._by_first_word.values():
+            yield from commands
@@ -0,0 +1,75 @@
+import time
+from collections import OrderedDict
+
+# قرارات كاشف التكرار
+OK, WARN, MUTE = 0, 1, 2
+
+
+class _SenderState:
+    """حالة مرسل واحد: رصيد الرسائل (token bucket)، آخر رسالة، وعدد المخالفات."""
+
+    __slots__ = ('tokens', 'last', 'strikes')
+
+    def __init__(self, tokens, last):
+        self.tokens = tokens
+        self.last = last
+        self.strikes = 0
+
+
+class FloodDetector:
+    """كاشف تكرار الرسائل لكل (chat_id, user_id) في الذاكرة بتكلفة O(1) لكل رسالة.
+
+    كل مرسل يملك رصيدًا يتسع لـ burst رسالة ويمتلئ بمعدل rate رسالة كل per ثانية.
+    نفاد الرصيد مخالفة: إنذار (WARN)، وعند بلوغ warn_limit مخالفات كتم (MUTE).
+    المرسلون الخاملون لأكثر من idle_ttl ثانية يُحذفون من أقدمهم، والعدد الكلي لا يتجاوز
+    max_senders، فتبقى الذاكرة محدودة مهما كان عدد الأعضاء.
+    """
+
+    def __init__(self, rate=5, per=3.0, burst=7, warn_limit=3, idle_ttl=300.0, max_senders=100000):
+        self.refill = rate / per
+        self.burst = burst
+        self.warn_limit = warn_limit
+        self.idle_ttl = idle_ttl
+        self.max_senders = max_senders
+        # مرتبة حسب آخر رسالة، فالأقدم دائمًا في البداية
+        self._senders = OrderedDict()
+
+    def check(self, chat_id, user_id, now=None):
+        """تسجيل رسالة وإرجاع القرار: OK أو WARN أو MUTE"""
+        if now is None:
+            now = time.monotonic()
+        key = (chat_id, user_id)
+        senders = self._senders
+
+        state = senders.get(key)
+        if state is None:
+            state = senders[key] = _SenderState(self.burst, now)
+            self._evict(now)
+        else:
+            senders.move_to_end(key)
+            state.tokens = min(self.burst, state.tokens + (now - state.last) * self.refill)
+            state.last = now
+
+        if state.tokens >= 1:
+            state.tokens -= 1
+            return OK
+
+        # مخالفة: رصيد جديد كفرصة أخرى، والكتم عند تكرار المخالفات
+        state.tokens = self.burst
+        state.strikes += 1
+        if state.strikes >= self.warn_limit:
+            state.strikes = 0
+            return MUTE
+        return WARN
+
+    def _evict(self, now):
+        senders = self._senders
+        cutoff = now - self.idle_ttl
+        while senders:
+            oldest = next(iter(senders.values()))
+            if oldest.last >= cutoff and len(senders) <= self.max_senders:
+                break
+            senders.popitem(last=False)
+
+    def __len__(self):
+        return len(self._senders)
@@ -1,23 +1,48 @@
+import asyncio
+import functools
 import logging
 import os 
+import pickle
 import re 
 from datetime import datetime, timedelta
 import pytz
 
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ChatPermissions
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes, CallbackQueryHandler, ConversationHandler
-from telegram.error import TelegramError
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ChatPermissions, ReplyParameters
+from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes, CallbackQueryHandler, ConversationHandler, ChatMemberHandler
+from telegram.error import TelegramError, RetryAfter, NetworkError, BadRequest
+from telegram.helpers import escape_markdown
 
 from database import Database # تأكد أن هذا الملف موجود وصحيح
+from async_db import AsyncDatabase
+from admins import ChatAdminCache
+from pipeline import MessagePipeline, MessageContext
+from replies import Reply, reply_data_from_message
+from commands import CommandRouter, ADMIN, DEVELOPER
+from scheduler import PunishmentScheduler
+from flood import FloodDetector, WARN, MUTE
+from outbox import Outbox, MODERATION, NORMAL, COSMETIC, MAX_TEXT_LENGTH, text_length
+from raid import JoinRaidDetector
+from policy import classify_message
+from metrics import Metrics, SlowUpdateProfiler, cache_collector
+from webhook import InstrumentedApplication, instrument_handlers, serve_webhook
+from workers import ShardedReceiver, shard_for
+from snapshot import read_snapshot, write_snapshot
 
 # -------------------- Global Configuration --------------------
 # يجب تعيين BOT_TOKEN و WEBHOOK_URL في Render Dashboard
-BOT_TOKEN = os.environ.get("8458158034:AAGbNwJH5Sn2FQqnkxIkZTvLWjglGUfcBaU") 
+BOT_TOKEN = os.environ.get("BOT_TOKEN")
 PORT = int(os.environ.get('PORT', 8080))
 WEBHOOK_URL = os.environ.get('WEBHOOK_URL', 'https://your-app-name.onrender.com')
-
-if not BOT_TOKEN:
-    raise ValueError("BOT_TOKEN environment variable not set. Please set it on Render.")
+DB_PATH = os.environ.get('DB_PATH', 'angel_bot.db')
+WEBHOOK_SECRET = os.environ.get('WEBHOOK_SECRET')
+# تسجيل عينات من مكدس التحديثات الأبطأ من هذه المدة بالثواني (0 للتعطيل)
+SLOW_UPDATE_SECONDS = float(os.environ.get('SLOW_UPDATE_SECONDS', 0))
+# عدد عمليات المعالجة: أكثر من 1 يوزع المحادثات على عمليات منفصلة حسب chat_id (انظر workers.py)
+WORKERS = int(os.environ.get('WORKERS', 1))
+WORKER_INDEX, WORKER_COUNT = 0, 1  # تُعين في configure_worker داخل كل عملية عامل
+# لقطة الذاكرة المؤقتة تُكتب عند الإيقاف وتُحمل عند التشغيل التالي (فارغ للتعطيل)، وتُتجاهل إذا كانت أقدم من SNAPSHOT_MAX_AGE
+SNAPSHOT_PATH = os.environ.get('SNAPSHOT_PATH', f"{DB_PATH}.hot")
+SNAPSHOT_MAX_AGE = float(os.environ.get('SNAPSHOT_MAX_AGE', 300))
 # --------------------------------------------------------------
 
 # -------------------- Global States and Variables --------------------
@@ -28,6 +53,32 @@ WAITING_FOR_GLOBAL_KEYWORD, WAITING_FOR_GLOBAL_REPLY = range(2, 4)
 WAITING_FOR_CUSTOM_WELCOME = 4 
 WAITING_FOR_FORBIDDEN_WORD = 5 
 
+# حدود كشف التكرار: 5 رسائل كل 3 ثوانٍ (مع سماح بـ 7 متتالية)، والكتم بعد 3 مخالفات
+FLOOD_RATE = int(os.environ.get('FLOOD_RATE', 5))
+FLOOD_PER_SECONDS = float(os.environ.get('FLOOD_PER_SECONDS', 3))
+FLOOD_BURST = int(os.environ.get('FLOOD_BURST', 7))
+FLOOD_WARN_LIMIT = int(os.environ.get('FLOOD_WARN_LIMIT', 3))
+FLOOD_MUTE_SECONDS = int(os.environ.get('FLOOD_MUTE_SECONDS', 600))
+
+# وضع الغارة: 10 منضمين خلال دقيقة يحول المجموعة لمعالجة الانضمامات دفعة كل 5 ثوانٍ،
+# ويعود للوضع العادي بعد دقيقتين دون تجاوز الحد. كتم الجدد (antiflood_new) لمدة 10 دقائق
+RAID_JOIN_THRESHOLD = int(os.environ.get('RAID_JOIN_THRESHOLD', 10))
+RAID_WINDOW_SECONDS = float(os.environ.get('RAID_WINDOW_SECONDS', 60))
+RAID_COOLDOWN_SECONDS = float(os.environ.get('RAID_COOLDOWN_SECONDS', 120))
+RAID_BATCH_SECONDS = float(os.environ.get('RAID_BATCH_SECONDS', 5))
+NEW_MEMBER_MUTE_SECONDS = int(os.environ.get('NEW_MEMBER_MUTE_SECONDS', 600))
+WELCOME_MAX_NAMES = 20
+# متغيرات قالب الترحيب بعد تهريبه لـ MarkdownV2
+WELCOME_NAME_PLACEHOLDER = escape_markdown('{name}', version=2)
+WELCOME_CHAT_PLACEHOLDER = escape_markdown('{chat}', version=2)
+
+# الاحتفاظ بالبيانات: مجموعة دون رسائل 7 أيام تُعد غير نشطة، وإحصائيات أعضائها تُحذف بعد 180 يومًا
+# دون نشاط؛ الحذف على دفعات صغيرة كل ساعة حتى لا تتأخر كتابات البوت
+ACTIVE_GROUP_DAYS = int(os.environ.get('ACTIVE_GROUP_DAYS', 7))
+RETENTION_DAYS = int(os.environ.get('RETENTION_DAYS', 180))
+RETENTION_BATCH = int(os.environ.get('RETENTION_BATCH', 500))
+RETENTION_INTERVAL_SECONDS = float(os.environ.get('RETENTION_INTERVAL_SECONDS', 3600))
+
 OWNER_ID = None
 OWNER_USERNAME = "@h_7_m" # يستخدم لـ is_admin
 
@@ -37,7 +88,31 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-db = Database()
+# جميع استدعاءات قاعدة البيانات تُنفذ خارج حلقة الأحداث ويجب انتظارها (await)
+# مقاييس Prometheus تُعرض على /metrics بجانب الـ Webhook (انظر webhook.serve_webhook)
+metrics = Metrics()
+db = AsyncDatabase(Database(DB_PATH), metrics=metrics)
+admin_cache = ChatAdminCache()
+metrics.add_collector(cache_collector(lambda: dict(db.db.cache_stats(), admins=admin_cache.stats())))
+
+def is_transient_error(e: Exception) -> bool:
+    """أخطاء مؤقتة تستحق إعادة المحاولة (BadRequest يرث NetworkError لكنه خطأ دائم)."""
+    return isinstance(e, (RetryAfter, NetworkError)) and not isinstance(e, BadRequest)
+
+# جميع الرسائل الصادرة تمر عبر طابور واحد يحترم حدود تيليجرام (انظر outbox.Outbox)
+outbox = Outbox(is_transient=is_transient_error)
+metrics.add_collector(lambda: [
+    ('outbox_calls_total', 'counter', 'Outbound Bot API calls by outcome', 'outcome',
+     {'sent': outbox.sent, 'retried': outbox.retries, 'failed': outbox.failed, 'coalesced': outbox.coalesced}),
+    ('outbox_pending', 'gauge', 'Calls waiting in the outbox', None, {None: outbox.pending()}),
+])
+
+def reply(message, text: str, priority: int = NORMAL, **kwargs):
+    """الرد على رسالة عبر طابور الإرسال، ويعيد Future بالرسالة المرسلة (لا حاجة لانتظاره)."""
+    return outbox.send_message(
+        message.chat_id, text, priority=priority,
+        reply_parameters=ReplyParameters(message.message_id, allow_sending_without_reply=True), **kwargs
+    )
 
 # -------------------- الدوال الأساسية والتحقق --------------------
 
@@ -45,7 +120,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     keyboard = [[InlineKeyboardButton("أضفني لمجموعتك", url=f"https://t.me/{context.bot.username}?startgroup=true")]]
     reply_markup = InlineKeyboardMarkup(keyboard)
     
-    total_users = db.get_total_users()
+    total_users = await db.get_total_users()
     
     welcome_message = (
         "• أهلاً بك عزيزي انا بوت اسمي ديل\n"
@@ -53,181 +128,528 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f"• مطور البوت ↤︎ {OWNER_USERNAME}"
     )
     
-    await update.message.reply_text(welcome_message, reply_markup=reply_markup)
+    reply(update.message, welcome_message, reply_markup=reply_markup)
 
 async def is_admin(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int = None) -> bool:
     if not update.effective_chat: return False
     chat_id = update.effective_chat.id
     user_id = user_id or update.effective_user.id
     
-    # Check custom ranks
-    if db.is_owner(chat_id, user_id) or db.is_admin(chat_id, user_id) or db.is_vip(chat_id, user_id):
+    # Check custom ranks (owner / admin / vip) باستعلام واحد مخزن مؤقتًا
+    if await db.get_user_ranks(chat_id, user_id):
         return True
     
-    # Check Telegram ranks
+    # Check Telegram ranks من قائمة المشرفين المخزنة لكل مجموعة
     try:
-        member = await context.bot.get_chat_member(chat_id, user_id)
-        return member.status in ['creator', 'administrator']
-    except:
+        return user_id in await admin_cache.get_admin_ids(context.bot, chat_id)
+    except TelegramError:
         return False
+
+async def track_admin_changes(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """إبطال قائمة المشرفين المخزنة عند ترقية أو تنزيل أي مشرف."""
+    change = update.chat_member or update.my_chat_member
+    statuses = {change.old_chat_member.status, change.new_chat_member.status}
+    if statuses & {'creator', 'administrator'}:
+        admin_cache.invalidate(change.chat.id)
         
 # -------------------- دوال الأقفال والتحكم الجديدة --------------------
 
 async def toggle_lock(update: Update, context: ContextTypes.DEFAULT_TYPE, lock_type: str, action: bool):
-    """دالة مساعدة لتبديل حالة أي قفل في المجموعة."""
-    if update.effective_chat.type == 'private' or not await is_admin(update, context):
-        await update.message.reply_text("هذا الأمر للمشرفين فقط")
-        return
-
+    """دالة مساعدة لتبديل حالة أي قفل في المجموعة (الصلاحية يتحقق منها موجه الأوامر)."""
     chat_id = update.effective_chat.id
-    db.set_lock_status(chat_id, lock_type, action) 
+    await db.set_lock_status(chat_id, lock_type, action) 
     status = "تم قفل" if action else "تم فتح"
     
     lock_name_ar = {
         'links': 'الروابط', 'photos': 'الصور', 'gifs': 'المتحركات',  
-        'stickers': 'الملصقات', 'forward': 'التوجيه', 'antiflood_new': 'كتم الأعضاء الجدد'
+        'stickers': 'الملصقات', 'forward': 'التوجيه', 'group': 'المجموعة', 'antiflood_new': 'كتم الأعضاء الجدد'
     }.get(lock_type, lock_type)
     
-    await update.message.reply_text(f"{status} **{lock_name_ar}** بنجاح.", parse_mode='Markdown')
-
-async def lock_links(update: Update, context: ContextTypes.DEFAULT_TYPE): await toggle_lock(update, context, 'links', True)
-async def unlock_links(update: Update, context: ContextTypes.DEFAULT_TYPE): await toggle_lock(update, context, 'links', False)
-async def lock_photos(update: Update, context: ContextTypes.DEFAULT_TYPE): await toggle_lock(update, context, 'photos', True)
-async def unlock_photos(update: Update, context: ContextTypes.DEFAULT_TYPE): await toggle_lock(update, context, 'photos', False)
-async def lock_gifs(update: Update, context: ContextTypes.DEFAULT_TYPE): await toggle_lock(update, context, 'gifs', True)
-async def unlock_gifs(update: Update, context: ContextTypes.DEFAULT_TYPE): await toggle_lock(update, context, 'gifs', False)
-async def lock_stickers(update: Update, context: ContextTypes.DEFAULT_TYPE): await toggle_lock(update, context, 'stickers', True)
-async def unlock_stickers(update: Update, context: ContextTypes.DEFAULT_TYPE): await toggle_lock(update, context, 'stickers', False)
-async def lock_forward(update: Update, context: ContextTypes.DEFAULT_TYPE): await toggle_lock(update, context, 'forward', True)
-async def unlock_forward(update: Update, context: ContextTypes.DEFAULT_TYPE): await toggle_lock(update, context, 'forward', False)
-async def enable_new_user_mute(update: Update, context: ContextTypes.DEFAULT_TYPE): await toggle_lock(update, context, 'antiflood_new', True)
-async def disable_new_user_mute(update: Update, context: ContextTypes.DEFAULT_TYPE): await toggle_lock(update, context, 'antiflood_new', False)
-
+    reply(update.message, f"{status} **{lock_name_ar}** بنجاح.", parse_mode='Markdown')
 
 # -------------------- رسائل المغادرة المخصصة (تمت الإضافة) --------------------
 
 async def enable_leave_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if update.effective_chat.type == 'private' or not await is_admin(update, context): return
-    db.set_leave_message_status(update.effective_chat.id, True) 
-    await update.message.reply_text(f"تم تفعيل رسالة مغادرة الأعضاء.")
+    await db.set_leave_message_status(update.effective_chat.id, True) 
+    reply(update.message, f"تم تفعيل رسالة مغادرة الأعضاء.")
 
 async def disable_leave_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if update.effective_chat.type == 'private' or not await is_admin(update, context): return
-    db.set_leave_message_status(update.effective_chat.id, False) 
-    await update.message.reply_text(f"تم تعطيل رسالة مغادرة الأعضاء.")
+    await db.set_leave_message_status(update.effective_chat.id, False) 
+    reply(update.message, f"تم تعطيل رسالة مغادرة الأعضاء.")
 
 async def handle_left_member(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.effective_chat.type == 'private' or not update.message.left_chat_member: return
     
     chat_id = update.effective_chat.id
-    if db.is_leave_message_enabled(chat_id): 
-        member_name = update.message.left_chat_member.first_name
-        await context.bot.send_message(
+    if await db.is_leave_message_enabled(chat_id): 
+        member = update.message.left_chat_member
+        # إشعارات المغادرة المتتالية في المجموعة نفسها تُدمج في رسالة واحدة، لذا يُهرب الاسم
+        # حتى لا يُفشل اسم واحد يحوي _ أو * الرسالة المدمجة كلها
+        outbox.send_message(
             chat_id,
-            f"غادرنا للتو العضو [{member_name}](tg://user?id={update.message.left_chat_member.id}) 💔.",
-            parse_mode='Markdown'
+            f"غادرنا للتو العضو {member.mention_markdown_v2(member.first_name)} 💔{escape_markdown('.', version=2)}",
+            priority=COSMETIC, coalesce_key=('left', chat_id),
+            parse_mode='MarkdownV2'
         )
 
 # -------------------- دوال نظام الردود والمحادثة (تمت الإضافة) --------------------
 
 async def add_reply_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.effective_chat.type == 'private':
-        await update.message.reply_text("هذا الأمر يعمل فقط في المجموعات.")
+        reply(update.message, "هذا الأمر يعمل فقط في المجموعات.")
         return ConversationHandler.END
     
     if not await is_admin(update, context):
-        await update.message.reply_text("هذا الأمر للمشرفين فقط")
+        reply(update.message, "هذا الأمر للمشرفين فقط")
         return ConversationHandler.END
     
-    await update.message.reply_text("حسناً الآن ارسل الكلمة التي تريدها للرد.")
+    reply(update.message, "حسناً الآن ارسل الكلمة التي تريدها للرد.")
     return WAITING_FOR_KEYWORD
 
 async def cancel_add_reply(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data.clear()
-    await update.message.reply_text("تم الغاء اضافة الرد")
+    reply(update.message, "تم الغاء اضافة الرد")
     return ConversationHandler.END
 
 async def add_global_reply_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.effective_user.username != OWNER_USERNAME.lstrip('@'): 
-        await update.message.reply_text("هذا الأمر للمطور فقط")
+        reply(update.message, "هذا الأمر للمطور فقط")
         return ConversationHandler.END
     
-    await update.message.reply_text("حسنًا، أرسل الكلمة التي تريد أن يرد عليها.")
+    reply(update.message, "حسنًا، أرسل الكلمة التي تريد أن يرد عليها.")
     return WAITING_FOR_GLOBAL_KEYWORD
 
 async def receive_keyword(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data['keyword'] = update.message.text.strip()
-    await update.message.reply_text("حسناً، الآن ارسل الرد الذي تريده لهذه الكلمة.")
+    reply(update.message, "حسناً، الآن ارسل الرد الذي تريده لهذه الكلمة.")
     return WAITING_FOR_REPLY
 
 async def receive_reply(update: Update, context: ContextTypes.DEFAULT_TYPE):
     keyword = context.user_data.get('keyword')
-    # يجب إضافة منطق حفظ الرد هنا في database.py
-    await update.message.reply_text(f"تم حفظ الرد المحلي للكلمة: **{keyword}** بنجاح.", parse_mode='Markdown')
+    await db.add_custom_reply(update.effective_chat.id, keyword, reply_data_from_message(update.message))
+    reply(update.message, f"تم حفظ الرد المحلي للكلمة: **{keyword}** بنجاح.", parse_mode='Markdown')
     context.user_data.clear()
     return ConversationHandler.END
 
 async def receive_global_keyword(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data['global_keyword'] = update.message.text.strip()
-    await update.message.reply_text("حسناً، الآن ارسل الرد العام الذي تريده.")
+    reply(update.message, "حسناً، الآن ارسل الرد العام الذي تريده.")
     return WAITING_FOR_GLOBAL_REPLY
 
 async def receive_global_reply(update: Update, context: ContextTypes.DEFAULT_TYPE):
     keyword = context.user_data.get('global_keyword')
-    # يجب إضافة منطق حفظ الرد العام هنا في database.py
-    await update.message.reply_text(f"تم حفظ الرد العام للكلمة: **{keyword}** بنجاح.", parse_mode='Markdown')
+    await db.add_global_reply(keyword, reply_data_from_message(update.message))
+    reply(update.message, f"تم حفظ الرد العام للكلمة: **{keyword}** بنجاح.", parse_mode='Markdown')
     context.user_data.clear()
     return ConversationHandler.END
 
 async def add_forbidden_word_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.effective_chat.type == 'private' or not await is_admin(update, context):
-        await update.message.reply_text("هذا الأمر للمشرفين فقط")
+        reply(update.message, "هذا الأمر للمشرفين فقط")
         return ConversationHandler.END
-    await update.message.reply_text("حسناً، الآن أرسل الكلمة التي تريد إضافتها للقائمة الممنوعة.")
+    reply(update.message, "حسناً، الآن أرسل الكلمة التي تريد إضافتها للقائمة الممنوعة (أو عدة كلمات، كل كلمة في سطر).")
     return WAITING_FOR_FORBIDDEN_WORD
 
 async def receive_forbidden_word(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    word = update.message.text.strip()
+    # قائمة ملصقة: كل سطر كلمة، وتُضاف جميعها في معاملة واحدة
+    words = [line.strip() for line in update.message.text.splitlines() if line.strip()]
     chat_id = update.effective_chat.id
-    db.add_forbidden_word(chat_id, word) 
-    await update.message.reply_text(f"تمت إضافة الكلمة **{word}** إلى قائمة الكلمات الممنوعة.", parse_mode='Markdown')
+    added = await db.add_forbidden_words(chat_id, words)
+    if len(words) == 1:
+        reply(update.message, f"تمت إضافة الكلمة **{words[0]}** إلى قائمة الكلمات الممنوعة.", parse_mode='Markdown')
+    else:
+        reply(update.message, f"تمت إضافة {added} كلمة جديدة إلى قائمة الكلمات الممنوعة ({len(words) - added} موجودة مسبقًا).")
     return ConversationHandler.END
 
 async def clear_forbidden_words(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if update.effective_chat.type == 'private' or not await is_admin(update, context):
-        await update.message.reply_text("هذا الأمر للمشرفين فقط")
+    await db.clear_forbidden_words(update.effective_chat.id) 
+    reply(update.message, "تم مسح قائمة الكلمات الممنوعة بالكامل.")
+
+async def remove_forbidden_word(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    word = " ".join(context.args).strip()
+    if not word:
+        reply(update.message, "اكتب الكلمة بعد الأمر، مثال: حذف كلمة ممنوعة كلمة")
+        return
+    if await db.remove_forbidden_word(update.effective_chat.id, word):
+        reply(update.message, f"تم حذف الكلمة **{word}** من قائمة الكلمات الممنوعة.", parse_mode='Markdown')
+    else:
+        reply(update.message, f"الكلمة **{word}** ليست في قائمة الكلمات الممنوعة.", parse_mode='Markdown')
+
+FORBIDDEN_WORDS_PAGE_SIZE = 50
+
+async def list_forbidden_words(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """صفحة من الكلمات الممنوعة؛ الصفحة التالية تبدأ بعد آخر كلمة معروضة (الكلمات الممنوعة <آخر كلمة>)."""
+    chat_id = update.effective_chat.id
+    after = " ".join(context.args) if context.args else None
+    # كلمة إضافية لمعرفة وجود صفحة تالية دون عد القائمة كلها
+    words = await db.get_forbidden_words(chat_id, FORBIDDEN_WORDS_PAGE_SIZE + 1, after)
+    if not words:
+        reply(update.message, "لا توجد كلمات ممنوعة في هذه المجموعة." if after is None else "لا توجد كلمات أخرى.")
         return
-    db.clear_forbidden_words(update.effective_chat.id) 
-    await update.message.reply_text("تم مسح قائمة الكلمات الممنوعة بالكامل.")
+    # الصفحة تنتهي عند آخر كلمة تتسع مع التذييل ضمن حد طول الرسالة
+    header = "• الكلمات الممنوعة:"
+    lines, length = [], text_length(header)
+    for word in words[:FORBIDDEN_WORDS_PAGE_SIZE]:
+        line = f"\n- {word}"
+        footer_length = text_length(f"\n\nللمزيد: الكلمات الممنوعة {word}")
+        if lines and length + text_length(line) + footer_length > MAX_TEXT_LENGTH:
+            break
+        lines.append(line)
+        length += text_length(line)
+    shown = words[:len(lines)]
+    footer = f"\n\nللمزيد: الكلمات الممنوعة {shown[-1]}" if len(shown) < len(words) else ""
+    reply(update.message, header + "".join(lines) + footer)
+
+
+# -------------------- الأعضاء الجدد ووضع الغارة --------------------
+
+raid_detector = JoinRaidDetector(
+    threshold=RAID_JOIN_THRESHOLD, window=RAID_WINDOW_SECONDS,
+    cooldown=RAID_COOLDOWN_SECONDS, batch_window=RAID_BATCH_SECONDS,
+)
 
+async def welcome_new_member(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """معالج واحد لتحديث NEW_CHAT_MEMBERS: إضافة البوت، كتم الجدد، والترحيب."""
+    if update.effective_chat.type == 'private' or not update.message.new_chat_members: return
+
+    chat_id = update.effective_chat.id
+    members = update.message.new_chat_members
+    if any(member.id == context.bot.id for member in members):
+        await check_bot_member(update, context)
+    members = [member for member in members if member.id != context.bot.id]
+    if not members: return
+
+    # أثناء الغارة لا قراءة للإعدادات ولا إرسال لكل انضمام: تُجمع الدفعة وتُعالج مرة واحدة
+    if raid_detector.record(chat_id, len(members)):
+        if raid_detector.buffer(chat_id, members):
+            context.job_queue.run_once(flush_join_batch, when=raid_detector.batch_window, chat_id=chat_id)
+        return
+
+    await process_new_members(chat_id, update.effective_chat.title, members)
+
+async def flush_join_batch(context: ContextTypes.DEFAULT_TYPE):
+    """معالجة دفعة المنضمين المتراكمة أثناء الغارة."""
+    chat_id = context.job.chat_id
+    members = raid_detector.drain(chat_id)
+    if members:
+        logger.info(f"Join raid in {chat_id}: processing {len(members)} new members as one batch")
+        await process_new_members(chat_id, None, members)
+
+async def process_new_members(chat_id: int, chat_title, members):
+    """كتم الجدد (antiflood_new) دفعة واحدة والترحيب بهم (welcome_enabled) في رسالة واحدة."""
+    settings = await db.get_group_settings(chat_id)
+    if settings.get('antiflood_new'):
+        await restrict_new_members(chat_id, [member.id for member in members if not member.is_bot])
+    if settings.get('welcome_enabled'):
+        # كل النصوص من المستخدمين (الأسماء، عنوان المجموعة، الترحيب المخصص) تُهرب، فاسم واحد
+        # يحوي _ أو * لا يُفشل ترحيب الدفعة كلها
+        names = "، ".join(member.mention_markdown_v2(member.first_name) for member in members[:WELCOME_MAX_NAMES])
+        if len(members) > WELCOME_MAX_NAMES:
+            names += escape_markdown(f" و{len(members) - WELCOME_MAX_NAMES} آخرين", version=2)
+        template = escape_markdown(settings.get('custom_welcome_msg') or "أهلًا وسهلًا {name} في {chat} 🌹", version=2)
+        text = (template.replace(WELCOME_NAME_PLACEHOLDER, names)
+                .replace(WELCOME_CHAT_PLACEHOLDER, escape_markdown(chat_title or "المجموعة", version=2)))
+        # الترحيبات المتتالية التي لم تُرسل بعد تُدمج في رسالة واحدة
+        outbox.send_message(chat_id, text, priority=COSMETIC, coalesce_key=('welcome', chat_id), parse_mode='MarkdownV2')
+
+async def restrict_new_members(chat_id: int, user_ids):
+    """كتم مؤقت لمجموعة أعضاء: الطلبات تُرسل للطابور معًا، والحفظ في معاملة واحدة."""
+    if not user_ids: return
+    until = datetime.now(pytz.utc) + timedelta(seconds=NEW_MEMBER_MUTE_SECONDS)
+    results = await asyncio.gather(*(
+        outbox.submit('restrict_chat_member', chat_id, MODERATION,
+                      user_id=user_id, permissions=ChatPermissions(can_send_messages=False), until_date=until)
+        for user_id in user_ids
+    ), return_exceptions=True)
+    muted = [user_id for user_id, result in zip(user_ids, results) if not isinstance(result, BaseException)]
+    if not muted: return
+    until_ts = await db.add_muted_many(chat_id, muted, until)
+    for user_id in muted:
+        punishment_scheduler.add(chat_id, user_id, 'muted', until_ts)
+
+async def check_bot_member(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """رسالة تعريف عند إضافة البوت إلى مجموعة جديدة."""
+    outbox.send_message(update.effective_chat.id, "شكرًا لإضافتي 🌹 ارفعني مشرفًا حتى أتمكن من حماية المجموعة.")
 
 # -------------------- الدوال المتبقية (يجب أن تكون موجودة في الكود الأصلي) --------------------
 
 # دوال يجب أن تكون معرفة لديك لتجنب NameError
-async def welcome_new_member(update: Update, context: ContextTypes.DEFAULT_TYPE): pass
-async def check_bot_member(update: Update, context: ContextTypes.DEFAULT_TYPE): pass
-async def check_spam(update: Update, context: ContextTypes.DEFAULT_TYPE): pass
-async def reply_to_salam(update: Update, context: ContextTypes.DEFAULT_TYPE): pass
-async def check_global_replies(update: Update, context: ContextTypes.DEFAULT_TYPE): pass
-async def check_custom_replies(update: Update, context: ContextTypes.DEFAULT_TYPE): pass
-async def check_group_locked(update: Update, context: ContextTypes.DEFAULT_TYPE): pass
-async def track_messages(update: Update, context: ContextTypes.DEFAULT_TYPE): pass
-async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE): pass
+async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE):
+    """تسجيل أي استثناء لم يُعالج وعده في angel_errors_total حسب نوعه."""
+    metrics.errors.inc(type(context.error).__name__)
+    logger.error("Exception while handling an update", exc_info=context.error)
 async def warn_callback(update: Update, context: ContextTypes.DEFAULT_TYPE): pass
 async def commands_callback(update: Update, context: ContextTypes.DEFAULT_TYPE): pass
-async def check_content_locks(update: Update, context: ContextTypes.DEFAULT_TYPE): pass
-async def handle_arabic_commands(update: Update, context: ContextTypes.DEFAULT_TYPE): pass
+
+# -------------------- مراحل معالجة الرسائل (Message Pipeline) --------------------
+# كل مرحلة تستقبل MessageContext المشترك وتعيد True إذا حذفت الرسالة أو عاقبت المرسل
+
+pipeline = MessagePipeline(settings_loader=db.get_group_settings, admin_checker=is_admin)
+
+async def check_content_locks(ctx: MessageContext):
+    # الأقفال (روابط، صور، متحركات، ملصقات، توجيه، قفل المجموعة): AND واحد بين سياسة
+    # المجموعة المجمعة وبتات نوع الرسالة، ولا تصنيف أصلًا في المجموعات غير المقفلة
+    policy = ctx.settings['content_policy']
+    if policy and policy & classify_message(ctx.message, ctx.entities) and not await ctx.is_admin():
+        outbox.submit('delete_message', ctx.chat_id, MODERATION, message_id=ctx.message.message_id)
+        return True
+
+    # فحص الكلمات الممنوعة بمرور واحد على النص مهما كان حجم القائمة
+    if not ctx.text: return False
+    matcher = await db.get_forbidden_matcher(ctx.chat_id)
+    if matcher and matcher.search(ctx.normalized_text, normalized=True) is not None and not await ctx.is_admin():
+        outbox.submit('delete_message', ctx.chat_id, MODERATION, message_id=ctx.message.message_id)
+        return True
+    return False
+
+flood_detector = FloodDetector(rate=FLOOD_RATE, per=FLOOD_PER_SECONDS, burst=FLOOD_BURST, warn_limit=FLOOD_WARN_LIMIT)
+
+async def check_spam(ctx: MessageContext):
+    if not ctx.user_id: return False
+    decision = flood_detector.check(ctx.chat_id, ctx.user_id)
+    if decision not in (WARN, MUTE) or await ctx.is_admin(): return False
+    
+    outbox.submit('delete_message', ctx.chat_id, MODERATION, message_id=ctx.message.message_id)
+    try:
+        if decision == MUTE:
+            await mute_member(ctx.context, ctx.chat_id, ctx.user_id, FLOOD_MUTE_SECONDS)
+            outbox.send_message(ctx.chat_id, f"تم كتم العضو لمدة {FLOOD_MUTE_SECONDS // 60} دقيقة بسبب التكرار.", priority=MODERATION)
+        else:
+            warnings = await db.add_warning(ctx.chat_id, ctx.user_id)
+            outbox.send_message(ctx.chat_id, f"⚠️ تحذير بسبب التكرار ({warnings}).", priority=MODERATION)
+    except TelegramError as e:
+        logger.info(f"Flood action failed in {ctx.chat_id}: {e}")
+    return True
+async def reply_to_salam(ctx: MessageContext): pass
+
+async def send_reply(ctx: MessageContext, stored: Reply):
+    """إرسال رد مخزن (نص أو وسائط) كرد على رسالة العضو بدالة الإرسال المحددة مسبقًا"""
+    sent = outbox.submit(
+        stored.method, ctx.chat_id, NORMAL,
+        reply_parameters=ReplyParameters(ctx.message.message_id, allow_sending_without_reply=True),
+        **stored.kwargs
+    )
+    if stored.file_id is not None and stored.file_unique_id is None:
+        sent.add_done_callback(functools.partial(remember_file_unique_id, stored))
+
+def remember_file_unique_id(stored: Reply, sent: asyncio.Future):
+    """حفظ file_unique_id للرد القديم بعد أول إرسال ناجح (مرة واحدة لكل رد)"""
+    if sent.cancelled() or sent.exception() is not None:
+        return
+    previous = stored.remember_file_unique_id(sent.result())
+    if previous is not None:
+        asyncio.get_running_loop().create_task(
+            db.update_reply_data(stored.chat_id, stored.keyword, previous, stored.stored))
+
+async def check_global_replies(ctx: MessageContext):
+    stored = await db.get_global_reply(ctx.text)
+    if stored:
+        await send_reply(ctx, stored)
+
+async def check_custom_replies(ctx: MessageContext):
+    stored = await db.get_custom_reply(ctx.chat_id, ctx.text)
+    if stored:
+        await send_reply(ctx, stored)
+
+
+# -------------------- جدول الأوامر العربية --------------------
+# كل أمر: العبارة، الدالة (بنفس توقيع معالجات تيليجرام، والوسائط في context.args)، والصلاحية
+
+commands = CommandRouter()
+
+LOCK_NAMES = {
+    'الروابط': 'links', 'الصور': 'photos', 'المتحركات': 'gifs',
+    'الملصقات': 'stickers', 'التوجيه': 'forward', 'المجموعة': 'group',
+}
+
+def lock_command(lock_type: str, action: bool):
+    async def callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        await toggle_lock(update, context, lock_type, action)
+    return callback
+
+for name_ar, lock_type in LOCK_NAMES.items():
+    commands.register(f'قفل {name_ar}', lock_command(lock_type, True), ADMIN)
+    commands.register(f'فتح {name_ar}', lock_command(lock_type, False), ADMIN)
+commands.register('تفعيل كتم الجدد', lock_command('antiflood_new', True), ADMIN)
+commands.register('تعطيل كتم الجدد', lock_command('antiflood_new', False), ADMIN)
+commands.register('تفعيل المغادرة', enable_leave_message, ADMIN)
+commands.register('تعطيل المغادرة', disable_leave_message, ADMIN)
+commands.register('مسح الكلمات الممنوعة', clear_forbidden_words, ADMIN)
+commands.register('حذف كلمة ممنوعة', remove_forbidden_word, ADMIN, takes_args=True)
+commands.register('الكلمات الممنوعة', list_forbidden_words, ADMIN, takes_args=True)
+
+TOP_TITLES = {'all': 'أكثر الأعضاء تفاعلاً', 'day': 'توب اليوم', 'week': 'توب الأسبوع'}
+
+def top_command(period: str):
+    async def callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        top = await db.get_top_users(update.effective_chat.id, 10, period)
+        if not top:
+            reply(update.message, "لا توجد رسائل مسجلة بعد.")
+            return
+        lines = [f"{i}. [{user_id}](tg://user?id={user_id}) ↤︎ {count}" for i, (user_id, count) in enumerate(top, 1)]
+        reply(update.message, f"• {TOP_TITLES[period]}:\n" + "\n".join(lines), parse_mode='Markdown')
+    return callback
+
+commands.register('التوب', top_command('all'))
+commands.register('توب اليوم', top_command('day'))
+commands.register('توب الاسبوع', top_command('week'))
+
+async def has_permission(ctx: MessageContext, permission: str) -> bool:
+    if permission == DEVELOPER:
+        return bool(ctx.update.effective_user) and ctx.update.effective_user.username == OWNER_USERNAME.lstrip('@')
+    if permission == ADMIN:
+        return await ctx.is_admin()
+    return True
+
+async def handle_arabic_commands(ctx: MessageContext):
+    resolved = commands.resolve(ctx.text)
+    if resolved is None: return False
+    
+    command, args = resolved
+    if not await has_permission(ctx, command.permission):
+        reply(ctx.message, "هذا الأمر للمطور فقط" if command.permission == DEVELOPER else "هذا الأمر للمشرفين فقط")
+        return False
+    ctx.context.args = args
+    await command.callback(ctx.update, ctx.context)
+    return False
+
+async def track_messages(ctx: MessageContext):
+    if ctx.user_id:
+        await db.increment_message_count(ctx.chat_id, ctx.user_id)
+
+pipeline.add_stage(check_content_locks, text_only=False)
+pipeline.add_stage(check_spam)
+pipeline.add_stage(reply_to_salam)
+pipeline.add_stage(check_global_replies)
+pipeline.add_stage(check_custom_replies)
+pipeline.add_stage(handle_arabic_commands)
+pipeline.add_stage(track_messages)
+
+async def flush_message_counts_job(context: ContextTypes.DEFAULT_TYPE):
+    """كتابة عدادات الرسائل المؤجلة دوريًا حتى لو هدأت المجموعات."""
+    await db.flush_message_counts()
+
+# -------------------- الكتم المؤقت ورفعه تلقائيًا --------------------
+
+async def lift_punishment(chat_id: int, user_id: int, punishment_type: str) -> bool:
+    """رفع عقوبة منتهية؛ يعيد False عند خطأ مؤقت لإعادة المحاولة لاحقًا."""
+    try:
+        if punishment_type == 'muted':
+            await outbox.submit('restrict_chat_member', chat_id, MODERATION,
+                                user_id=user_id, permissions=ChatPermissions.all_permissions())
+    except TelegramError as e:
+        if is_transient_error(e):
+            return False
+        # العضو غادر أو البوت لم يعد مشرفًا: لا فائدة من إعادة المحاولة
+        logger.info(f"Could not lift {punishment_type} for {user_id} in {chat_id}: {e}")
+    return True
+
+punishment_scheduler = PunishmentScheduler(db, lift_punishment)
+
+async def mute_member(context: ContextTypes.DEFAULT_TYPE, chat_id: int, user_id: int, seconds: int = None):
+    """كتم عضو (مؤقتًا إذا حُددت المدة) مع جدولة رفع الكتم في وقته."""
+    until = datetime.now(pytz.utc) + timedelta(seconds=seconds) if seconds else None
+    await outbox.submit('restrict_chat_member', chat_id, MODERATION,
+                        user_id=user_id, permissions=ChatPermissions(can_send_messages=False), until_date=until)
+    until_ts = await db.add_muted(chat_id, user_id, until)
+    punishment_scheduler.add(chat_id, user_id, 'muted', until_ts)
+
+async def unmute_member(context: ContextTypes.DEFAULT_TYPE, chat_id: int, user_id: int):
+    """رفع الكتم يدويًا وإلغاء موعد رفعه المجدول."""
+    await outbox.submit('restrict_chat_member', chat_id, MODERATION,
+                        user_id=user_id, permissions=ChatPermissions.all_permissions())
+    await db.remove_muted(chat_id, user_id)
+    punishment_scheduler.remove(chat_id, user_id, 'muted')
+
+async def retention_job(context: ContextTypes.DEFAULT_TYPE):
+    """حذف البيانات المنتهية دوريًا: عدادات الأيام والأسابيع القديمة، إحصائيات المجموعات غير النشطة،
+    والعقوبات المنتهية، ثم إعادة الصفحات الفارغة لنظام الملفات. كل دفعة معاملة منفصلة في خيط الكتابة،
+    فتتخللها كتابات البوت العادية."""
+    pruned = purged_stats = purged_punishments = 0
+    while (deleted := await db.prune_leaderboards(batch_size=RETENTION_BATCH)):
+        pruned += deleted
+    deactivated = await db.deactivate_chats(ACTIVE_GROUP_DAYS)
+    while (deleted := await db.purge_inactive_chat_stats(RETENTION_DAYS, RETENTION_BATCH)):
+        purged_stats += deleted
+    while (deleted := await db.purge_expired_punishments(batch_size=RETENTION_BATCH)):
+        purged_punishments += deleted
+    freed_pages = await db.incremental_vacuum()
+    if pruned or deactivated or purged_stats or purged_punishments or freed_pages:
+        logger.info(f"Retention: {pruned} old leaderboard rows deleted, {deactivated} chats became inactive, {purged_stats} stats rows and "
+                    f"{purged_punishments} expired punishments deleted, {freed_pages} pages freed")
+
+async def reload_global_replies_job(context: ContextTypes.DEFAULT_TYPE):
+    """الردود العامة قد تُضاف من عامل آخر؛ تُعاد قراءتها دوريًا في وضع العمال المتعددين."""
+    await db.reload_global_replies()
+
+def configure_worker(index: int, count: int) -> Metrics:
+    """إعداد هذه العملية كعامل index من count قبل build_application (يُستدعى من workers.worker_main)."""
+    global WORKER_INDEX, WORKER_COUNT, outbox
+    WORKER_INDEX, WORKER_COUNT = index, count
+    # حد تيليجرام العام للبوت كله، فيُقسم على العمال؛ حد كل مجموعة يبقى كما هو لأن المجموعة في عامل واحد
+    outbox = Outbox(global_rate=outbox.global_rate / count, global_burst=max(1, outbox.global_burst / count),
+                    is_transient=is_transient_error)
+    punishment_scheduler.owns = lambda chat_id: shard_for(chat_id, count) == index
+    metrics.const_labels = {'worker': index}
+    return metrics
+
+def snapshot_path() -> str:
+    """لقطة لكل عامل، لأن كل عامل يحمل في ذاكرته محادثاته فقط"""
+    return SNAPSHOT_PATH if WORKER_COUNT == 1 else f"{SNAPSHOT_PATH}.{WORKER_INDEX}"
+
+def restore_hot_state():
+    state = read_snapshot(snapshot_path(), DB_PATH, Database.SCHEMA_VERSION, SNAPSHOT_MAX_AGE)
+    if state is None:
+        return
+    db.db.restore_hot_state(state['db'])
+    admin_cache.load(state['admins'])
+    logger.info(f"Restored hot-state snapshot: {len(state['db']['settings'])} chat settings, {len(state['admins'])} admin lists")
+
+def save_hot_state():
+    try:
+        write_snapshot(snapshot_path(), {'db': db.db.hot_state(), 'admins': admin_cache.items()},
+                       DB_PATH, Database.SCHEMA_VERSION)
+    except (OSError, pickle.PicklingError) as e:
+        logger.warning(f"Could not write hot-state snapshot: {e}")
+
+async def post_init(application: Application):
+    if SNAPSHOT_PATH:
+        restore_hot_state()
+    outbox.start(application.bot)
+    await punishment_scheduler.start(application.job_queue)
+
+async def post_stop(application: Application):
+    # post_shutdown يُستدعى بعد إغلاق البوت، فيُفرغ الطابور هنا والبوت ما زال يرسل
+    await outbox.stop()
+
+async def post_shutdown(application: Application):
+    if SNAPSHOT_PATH:
+        save_hot_state()
+    await db.close()
 
 # ... (كل دوال الأوامر الأخرى مثل ban_user, kick_user, إلخ)
 
 # -------------------- دالة main (تشغيل الـ Webhook) --------------------
 
-def main():
-    application = Application.builder().token(BOT_TOKEN).build()
+def build_application(token: str, request=None) -> Application:
+    """بناء التطبيق وجميع المعالجات والمهام دون تشغيل الـ Webhook.
+
+    request: طبقة HTTP بديلة (BaseRequest) لاستبدال الاتصال بتيليجرام، كما في benchmarks/bench_replay.py
+    """
+    profiler = SlowUpdateProfiler(SLOW_UPDATE_SECONDS) if SLOW_UPDATE_SECONDS > 0 else None
+    builder = (
+        Application.builder().token(token)
+        .application_class(InstrumentedApplication, kwargs={'metrics': metrics, 'profiler': profiler})
+        .post_init(post_init).post_stop(post_stop).post_shutdown(post_shutdown)
+    )
+    if request is not None:
+        builder = builder.request(request).get_updates_request(request)
+    application = builder.build()
     
     # Conversation Handlers (تم تصحيح states و fallbacks هنا)
+    # نقاط الدخول مطابقة تامة من مجموعة نصوص (بحث واحد) بدل تعابير نمطية متتالية
     conv_handler = ConversationHandler(
-        entry_points=[MessageHandler(filters.Regex('^اضف رد$'), add_reply_start)],
+        entry_points=[MessageHandler(filters.Text(['اضف رد']), add_reply_start)],
         states={
             WAITING_FOR_KEYWORD: [MessageHandler(filters.TEXT & ~filters.COMMAND, receive_keyword)],
             WAITING_FOR_REPLY: [MessageHandler(
@@ -236,12 +658,12 @@ def main():
                 receive_reply
             )]
         },
-        fallbacks=[MessageHandler(filters.Regex('^الغاء$'), cancel_add_reply)],
+        fallbacks=[MessageHandler(filters.Text(['الغاء']), cancel_add_reply)],
         allow_reentry=True
     )
     
     global_reply_handler = ConversationHandler(
-        entry_points=[MessageHandler(filters.Regex('^اضف رد عام$'), add_global_reply_start)],
+        entry_points=[MessageHandler(filters.Text(['اضف رد عام']), add_global_reply_start)],
         states={
             WAITING_FOR_GLOBAL_KEYWORD: [MessageHandler(filters.TEXT & ~filters.COMMAND, receive_global_keyword)],
             WAITING_FOR_GLOBAL_REPLY: [MessageHandler(
@@ -250,16 +672,16 @@ def main():
                 receive_global_reply
             )]
         },
-        fallbacks=[MessageHandler(filters.Regex('^الغاء$'), cancel_add_reply)],
+        fallbacks=[MessageHandler(filters.Text(['الغاء']), cancel_add_reply)],
         allow_reentry=True
     )
 
     forbidden_word_handler = ConversationHandler(
-        entry_points=[MessageHandler(filters.Regex('^اضف كلمة ممنوعة$'), add_forbidden_word_start)],
+        entry_points=[MessageHandler(filters.Text(['اضف كلمة ممنوعة']), add_forbidden_word_start)],
         states={
             WAITING_FOR_FORBIDDEN_WORD: [MessageHandler(filters.TEXT & ~filters.COMMAND, receive_forbidden_word)]
         },
-        fallbacks=[MessageHandler(filters.Regex('^الغاء$'), cancel_add_reply)],
+        fallbacks=[MessageHandler(filters.Text(['الغاء']), cancel_add_reply)],
         allow_reentry=True
     )
     
@@ -267,38 +689,62 @@ def main():
     application.add_handler(global_reply_handler)
     application.add_handler(forbidden_word_handler)
     
-    # 1. Handlers for Locks & Updates (Group 0 - High Priority)
-    application.add_handler(MessageHandler(filters.ALL & ~filters.COMMAND, check_content_locks), group=0)
+    # 1. Handlers for Updates (Group 0 - High Priority)
     application.add_handler(MessageHandler(filters.StatusUpdate.LEFT_CHAT_MEMBER, handle_left_member), group=0)
     
+    # معالج واحد للانضمام (يشمل إضافة البوت نفسه، انظر welcome_new_member)
     application.add_handler(MessageHandler(filters.StatusUpdate.NEW_CHAT_MEMBERS, welcome_new_member), group=0)
-    application.add_handler(MessageHandler(filters.StatusUpdate.NEW_CHAT_MEMBERS, check_bot_member), group=0)
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, check_spam), group=0)
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, reply_to_salam), group=0)
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, check_global_replies), group=0)
-
-    # 2. Handlers for Arabic Commands and Group Locks (Group 1 & 2)
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, check_custom_replies), group=1)
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, check_group_locked), group=1)
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_arabic_commands), group=2)
+
+    # 2. Message Pipeline (Group 1): الأقفال، السبام، الردود، الأوامر العربية، ثم التتبع
+    # في مرور واحد لكل تحديث (انظر pipeline.add_stage أعلاه لإضافة فحص جديد)
+    application.add_handler(MessageHandler(filters.ALL & ~filters.COMMAND, pipeline.handle), group=1)
     
-    # 3. Tracking (Group 3 - Low Priority)
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, track_messages), group=3)
+    application.job_queue.run_repeating(flush_message_counts_job, interval=db.flush_interval)
+    if WORKER_INDEX == 0:
+        application.job_queue.run_repeating(retention_job, interval=RETENTION_INTERVAL_SECONDS, first=60)
+    if WORKER_COUNT > 1:
+        application.job_queue.run_repeating(reload_global_replies_job, interval=60, first=60)
+    
+    application.add_handler(ChatMemberHandler(track_admin_changes, ChatMemberHandler.ANY_CHAT_MEMBER), group=-1)
     
     application.add_error_handler(error_handler)
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CallbackQueryHandler(warn_callback, pattern="^warn_"))
     application.add_handler(CallbackQueryHandler(commands_callback, pattern="^cmd_"))
-    
+
+    # زمن وأخطاء كل معالج وكل مرحلة في MessagePipeline
+    instrument_handlers(application, metrics)
+    pipeline.instrument(metrics.instrument)
+    return application
+
+def main():
+    if not BOT_TOKEN:
+        raise ValueError("BOT_TOKEN environment variable not set. Please set it on Render.")
+    if WORKERS > 1:
+        # المستقبل لا يعالج التحديثات بنفسه: يوزعها على WORKERS عملية حسب chat_id
+        logger.info(f"Starting sharded webhook on port {PORT} with {WORKERS} workers")
+        receiver = ShardedReceiver(BOT_TOKEN, WORKERS, build_application, configure_worker, secret_token=WEBHOOK_SECRET)
+        asyncio.run(receiver.serve(
+            listen="0.0.0.0", port=PORT, url_path="", webhook_url=f"{WEBHOOK_URL}",
+            allowed_updates=Update.ALL_TYPES,
+        ))
+        return
+
+    application = build_application(BOT_TOKEN)
+
     # 4. RUN WEBHOOK
-    logger.info(f"Starting webhook on port {PORT} at URL path '/'")
+    logger.info(f"Starting webhook on port {PORT} at URL path '/' (metrics at '/metrics')")
     
-    application.run_webhook(
+    # بدل application.run_webhook: الخادم نفسه يعرض /metrics على المنفذ ذاته
+    asyncio.run(serve_webhook(
+        application, metrics,
         listen="0.0.0.0",
         port=PORT,
         url_path="",
-        webhook_url=f"{WEBHOOK_URL}"
-    )
+        webhook_url=f"{WEBHOOK_URL}",
+        allowed_updates=Update.ALL_TYPES,  # تحديثات chat_member لازمة لإبطال قائمة المشرفين
+        secret_token=WEBHOOK_SECRET,
+    ))
 
 if __name__ == '__main__':
     main()
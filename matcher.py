@@ -0,0 +1,79 @@
+from collections import deque
+
+# التشكيل (الفتحة، الضمة، الكسرة، التنوين، الشدة، السكون...) والتطويل تُحذف،
+# والألف والياء والتاء المربوطة تُوحد حتى تتطابق الصيغ المختلفة للكلمة نفسها
+_ARABIC_FOLD = {code: None for code in range(0x064B, 0x0653)}
+_ARABIC_FOLD.update({
+    0x0670: None,                 # ألف خنجرية
+    0x0640: None,                 # تطويل ـ
+    ord('أ'): 'ا', ord('إ'): 'ا', ord('آ'): 'ا', ord('ٱ'): 'ا',
+    ord('ى'): 'ي', ord('ئ'): 'ي',
+    ord('ة'): 'ه',
+})
+_ARABIC_FOLD = str.maketrans(_ARABIC_FOLD)
+
+
+def normalize_arabic(text):
+    """توحيد النص العربي: حذف التشكيل والتطويل وتوحيد الألف والياء والتاء المربوطة"""
+    return text.translate(_ARABIC_FOLD).casefold()
+
+
+class ForbiddenWordMatcher:
+    """مطابق متعدد الكلمات (Aho-Corasick): يفحص الرسالة مرة واحدة مهما كان عدد الكلمات."""
+
+    __slots__ = ('_goto', '_fail', '_output', 'size')
+
+    def __init__(self, words):
+        self._goto = [{}]
+        self._output = [None]
+        self.size = 0
+
+        for word in words:
+            word = normalize_arabic(word.strip())
+            if not word:
+                continue
+            node = 0
+            for char in word:
+                nxt = self._goto[node].get(char)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[node][char] = nxt
+                    self._goto.append({})
+                    self._output.append(None)
+                node = nxt
+            if self._output[node] is None:
+                self._output[node] = word
+                self.size += 1
+
+        # بناء روابط الفشل بالعرض (BFS)، أبناء الجذر يفشلون إلى الجذر
+        self._fail = [0] * len(self._goto)
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, nxt in self._goto[node].items():
+                queue.append(nxt)
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                if node:
+                    self._fail[nxt] = self._goto[fail].get(char, 0)
+                if self._output[nxt] is None:
+                    self._output[nxt] = self._output[self._fail[nxt]]
+
+    def __bool__(self):
+        return self.size > 0
+
+    def search(self, text, normalized=False):
+        """إرجاع أول كلمة ممنوعة موجودة في النص، أو None
+        (normalized=True إذا كان النص قد مر مسبقًا بـ normalize_arabic)"""
+        if not self.size or not text:
+            return None
+        goto, fail, output = self._goto, self._fail, self._output
+        node = 0
+        for char in (text if normalized else normalize_arabic(text)):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            if output[node] is not None:
+                return output[node]
+        return None
@@ -0,0 +1,254 @@
+import bisect
+import functools
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+# حدود مدرجات الزمن بالثواني (من 0.5ms حتى 10s)
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _labels(label, value, const=''):
+    if label is None:
+        return const
+    value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return f'{const},{label}="{value}"' if const else f'{label}="{value}"'
+
+
+def _series(name, labels, value):
+    return f"{name}{{{labels}}} {value}" if labels else f"{name} {value}"
+
+
+class HistogramFamily:
+    """مدرج زمن لكل قيمة من قيم التسمية (label)؛ يُستخدم من خيط حلقة الأحداث فقط."""
+
+    def __init__(self, name, help, label=None, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.buckets = tuple(buckets)
+        self._series = {}  # قيمة التسمية -> [عدادات الحدود...، +Inf، المجموع]
+
+    def observe(self, value, amount):
+        series = self._series.get(value)
+        if series is None:
+            series = self._series[value] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect.bisect_left(self.buckets, amount)] += 1
+        series[-1] += amount
+
+    def render(self, const=''):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        for value, series in list(self._series.items()):
+            labels = _labels(self.label, value, const)
+            prefix = labels + ',' if labels else ''
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), series):
+                cumulative += count
+                yield f'{self.name}_bucket{{{prefix}le="{bound}"}} {cumulative}'
+            yield _series(f"{self.name}_sum", labels, series[-1])
+            yield _series(f"{self.name}_count", labels, cumulative)
+
+
+class CounterFamily:
+    """عداد تراكمي لكل قيمة تسمية؛ آمن للاستخدام من خيوط قاعدة البيانات."""
+
+    def __init__(self, name, help, label=None):
+        self.name = name
+        self.help = help
+        self.label = label
+        self._values = Counter()
+        self._lock = threading.Lock()
+
+    def inc(self, value=None, amount=1):
+        with self._lock:
+            self._values[value] += amount
+
+    def get(self, value=None):
+        return self._values[value]
+
+    def render(self, const=''):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        with self._lock:
+            values = list(self._values.items())
+        for value, count in values:
+            yield _series(self.name, _labels(self.label, value, const), count)
+
+
+class Metrics:
+    """سجل مقاييس بصيغة Prometheus النصية.
+
+    المدرجات والعدادات تُحدث مباشرة عند كل استدعاء (عمليتان حسابيتان وبحث ثنائي)، أما
+    القيم المتاحة أصلًا في مكان آخر (إحصائيات الذاكرة المؤقتة، الطابور) فتُقرأ عند
+    الطلب فقط عبر collectors.
+    """
+
+    def __init__(self, prefix='angel'):
+        self.prefix = prefix
+        # تسميات ثابتة تُضاف لكل سلسلة، مثل {'worker': 2} في وضع العمال المتعددين
+        self.const_labels = {}
+        self._families = []
+        self._collectors = []
+        self.updates = self.histogram('update_seconds', 'Time to process one update through all handler groups', 'kind')
+        self.handlers = self.histogram('handler_seconds', 'Handler and pipeline stage latency', 'handler')
+        self.handler_errors = self.counter('handler_errors_total', 'Exceptions raised by handlers', 'handler')
+        self.db = self.histogram('db_seconds', 'Database method latency as seen by the event loop', 'method')
+        self.db_errors = self.counter('db_errors_total', 'Exceptions raised by database methods', 'method')
+        self.errors = self.counter('errors_total', 'Errors reported to the error handler', 'type')
+        self.sqlite_statements = self.counter('sqlite_statements_total', 'SQL statements executed on any connection')
+        self.sqlite_commits = self.counter('sqlite_commits_total', 'SQLite transactions committed')
+        self.slow_updates = self.counter('slow_updates_total', 'Updates slower than the profiling threshold')
+
+    def histogram(self, name, help, label=None, buckets=DEFAULT_BUCKETS):
+        family = HistogramFamily(f"{self.prefix}_{name}", help, label, buckets)
+        self._families.append(family)
+        return family
+
+    def counter(self, name, help, label=None):
+        family = CounterFamily(f"{self.prefix}_{name}", help, label)
+        self._families.append(family)
+        return family
+
+    def add_collector(self, collector):
+        """collector() -> [(name, type, help, label, {قيمة التسمية: القيمة})] يُستدعى عند كل طلب /metrics"""
+        self._collectors.append(collector)
+
+    # ---------- القياس ----------
+
+    def instrument(self, callback, name=None, family=None, errors=None):
+        """تغليف دالة async لقياس زمنها وعد استثناءاتها (الافتراضي: مقاييس المعالجات)"""
+        name = name or callback.__qualname__
+        family = family or self.handlers
+        errors = errors or self.handler_errors
+
+        @functools.wraps(callback)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await callback(*args, **kwargs)
+            except Exception:
+                errors.inc(name)
+                raise
+            finally:
+                family.observe(name, time.perf_counter() - start)
+        return wrapper
+
+    def sqlite_trace(self, sql):
+        """trace callback لاتصالات SQLite (انظر Database.set_trace_callback)"""
+        self.sqlite_statements.inc()
+        if sql.startswith('COMMIT'):
+            self.sqlite_commits.inc()
+
+    # ---------- العرض ----------
+
+    def render(self):
+        const = ','.join(f'{name}="{value}"' for name, value in self.const_labels.items())
+        lines = []
+        for family in self._families:
+            lines.extend(family.render(const))
+        for collector in self._collectors:
+            try:
+                collected = collector()
+            except Exception:
+                logger.exception("Metrics collector %r failed", collector)
+                continue
+            for name, kind, help, label, values in collected:
+                name = f"{self.prefix}_{name}"
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+                lines.extend(_series(name, _labels(label, value, const), amount) for value, amount in values.items())
+        return '\n'.join(lines) + '\n'
+
+
+def merge_expositions(texts):
+    """دمج مخرجات render() لعدة عمليات (بتسميات ثابتة مختلفة) في عرض واحد صالح لـ Prometheus"""
+    families = {}
+    for text in texts:
+        name = None
+        for line in text.splitlines():
+            if line.startswith('# HELP ') or line.startswith('# TYPE '):
+                name = line.split(' ', 3)[2]
+                family = families.setdefault(name, ([], []))
+                if line not in family[0]:
+                    family[0].append(line)
+            elif line and name is not None:
+                families[name][1].append(line)
+    return ''.join('\n'.join(header + series) + '\n' for header, series in families.values())
+
+
+def cache_collector(caches):
+    """collector لإحصائيات LRUCache: caches() -> {اسم الذاكرة: stats()}"""
+    def collect():
+        stats = caches()
+        hit_ratio = {}
+        for name, s in stats.items():
+            lookups = s['hits'] + s['misses']
+            hit_ratio[name] = s['hits'] / lookups if lookups else 0.0
+        return [
+            ('cache_hits_total', 'counter', 'Cache hits', 'cache', {n: s['hits'] for n, s in stats.items()}),
+            ('cache_misses_total', 'counter', 'Cache misses', 'cache', {n: s['misses'] for n, s in stats.items()}),
+            ('cache_evictions_total', 'counter', 'Cache evictions', 'cache', {n: s['evictions'] for n, s in stats.items()}),
+            ('cache_size', 'gauge', 'Entries currently cached', 'cache', {n: s['size'] for n, s in stats.items()}),
+            ('cache_hit_ratio', 'gauge', 'Hits / lookups since start', 'cache', hit_ratio),
+        ]
+    return collect
+
+
+class SlowUpdateProfiler:
+    """أخذ عينات من مكدس خيط حلقة الأحداث أثناء التحديثات البطيئة فقط.
+
+    خيط منفصل يستيقظ كل interval ثانية ما دام هناك تحديث قيد المعالجة؛ إذا تجاوز التحديث
+    threshold ثانية يسجل المكدس الحالي لخيط الحلقة. عند انتهاء تحديث بطيء تُكتب أكثر
+    المكدسات تكرارًا في السجل. التحديثات السريعة لا تكلف سوى تعيين متغيرين.
+    """
+
+    def __init__(self, threshold=1.0, interval=0.005, top=5, max_depth=30):
+        self.threshold = threshold
+        self.interval = interval
+        self.top = top
+        self.max_depth = max_depth
+        self._thread_id = None
+        self._started = None
+        self._samples = Counter()
+        self._active = threading.Event()
+        self._sampler = None
+
+    def begin(self):
+        if self._sampler is None:
+            self._sampler = threading.Thread(target=self._run, name='slow-update-profiler', daemon=True)
+            self._sampler.start()
+        self._thread_id = threading.get_ident()
+        self._started = time.perf_counter()
+        self._active.set()
+
+    def end(self, label):
+        """إنهاء التحديث الحالي؛ يعيد المدة إذا كان بطيئًا (بعد كتابة العينات في السجل) وإلا None"""
+        self._active.clear()
+        elapsed = time.perf_counter() - self._started
+        samples, self._samples = self._samples, Counter()
+        if elapsed < self.threshold:
+            return None
+        lines = [f"Slow update ({label}) took {elapsed:.3f}s; {sum(samples.values())} stack samples:"]
+        for stack, count in samples.most_common(self.top):
+            lines.append(f"  {count} x {stack}")
+        logger.warning('\n'.join(lines))
+        return elapsed
+
+    def _run(self):
+        while True:
+            self._active.wait()
+            time.sleep(self.interval)
+            started = self._started
+            if not self._active.is_set() or time.perf_counter() - started < self.threshold:
+                continue
+            frame = sys._current_frames().get(self._thread_id)
+            if frame is not None:
+                stack = traceback.extract_stack(frame, limit=self.max_depth)
+                self._samples[' <- '.join(f"{f.name} ({f.filename.rsplit('/', 1)[-1]}:{f.lineno})"
+                                          for f in reversed(stack))] += 1
@@ -0,0 +1,240 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# فئات الأولوية: إجراءات وإشعارات الإشراف أولًا، والرسائل التجميلية (ترحيب، مغادرة) أخيرًا
+MODERATION, NORMAL, COSMETIC = 0, 1, 2
+
+
+class TokenBucket:
+    """رصيد طلبات يمتلئ بمعدل ثابت (rate طلب في الثانية) حتى capacity."""
+
+    __slots__ = ('rate', 'capacity', 'tokens', 'last')
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.last = time.monotonic()
+
+    def wait_time(self, now):
+        """الثواني المتبقية حتى يتوفر طلب واحد (0 إذا كان متاحًا الآن)"""
+        self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+
+class _Job:
+    __slots__ = ('method', 'chat_id', 'kwargs', 'priority', 'seq', 'future', 'coalesce_key', 'merge', 'attempts',
+                 'merged')
+
+    def __init__(self, method, chat_id, kwargs, priority, seq, future, coalesce_key, merge):
+        self.method = method
+        self.chat_id = chat_id
+        self.kwargs = kwargs
+        self.priority = priority
+        self.seq = seq
+        self.future = future
+        self.coalesce_key = coalesce_key
+        self.merge = merge
+        self.attempts = 0
+        self.merged = 0
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+# حد تيليجرام لطول الرسالة (بوحدات UTF-16)
+MAX_TEXT_LENGTH = 4096
+
+
+def text_length(text):
+    """طول النص كما يحسبه تيليجرام (وحدات UTF-16)"""
+    return len(text.encode('utf-16-le')) // 2
+
+
+def join_texts(old, new):
+    """الدمج الافتراضي للرسائل المتشابهة: نص واحد بأسطر متعددة، أو None إذا تجاوز حد الطول"""
+    text = f"{old['text']}\n{new['text']}"
+    if text_length(text) > MAX_TEXT_LENGTH:
+        return None
+    merged = dict(old)
+    merged['text'] = text
+    return merged
+
+
+class Outbox:
+    """طابور إرسال مركزي يحترم حدود تيليجرام.
+
+    حد عام (~30 رسالة/ثانية) وحد لكل مجموعة (~20 رسالة/دقيقة) عبر TokenBucket، مع
+    أولويات (MODERATION قبل NORMAL قبل COSMETIC) وترتيب ثابت داخل الأولوية نفسها.
+    الرسائل ذات coalesce_key نفسه التي لم تُرسل بعد تُدمج في رسالة واحدة (حتى max_merged رسالة
+    وحد طول تيليجرام، ثم تبدأ رسالة جديدة). عند RetryAfter
+    يتوقف الإرسال كله المدة المطلوبة، والأخطاء المؤقتة يُعاد إرسالها بتأخير متزايد.
+    """
+
+    # الرصيد المبدئي + المعدل × النافذة لا يتجاوز الحد، فلا تتخطى أي نافذة منزلقة حد تيليجرام:
+    # 5 + 25×1 ثانية = 30 رسالة، و3 + 17/60×60 ثانية = 20 رسالة لكل مجموعة
+    def __init__(self, global_rate=25, global_burst=5, per_chat_rate=17 / 60, per_chat_burst=3,
+                 max_retries=5, is_transient=None, max_merged=20):
+        self.global_rate = global_rate
+        self.global_burst = global_burst
+        self.per_chat_rate = per_chat_rate
+        self.per_chat_burst = per_chat_burst
+        self.max_retries = max_retries
+        # أقصى عدد رسائل تُدمج في رسالة واحدة؛ بعده (أو بعد حد الطول) تبدأ رسالة جديدة
+        self.max_merged = max_merged
+        # is_transient(exc) -> True للأخطاء المؤقتة (انقطاع الشبكة) التي يُعاد إرسالها بتأخير متزايد
+        self.is_transient = is_transient or (lambda exc: False)
+        self._global = TokenBucket(global_rate, global_burst)
+        self._chats = {}
+        self._ready = []      # heap of _Job
+        self._delayed = []    # heap of (ready_at, _Job)
+        self._coalescing = {}
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._paused_until = 0.0
+        self._bot = None
+        self._task = None
+        # الاستدعاءات الجارية: مرجع لكل مهمة حتى لا يجمعها GC، وحتى ينتظرها stop()
+        self._inflight = set()
+        self.sent = 0
+        self.retries = 0
+        self.failed = 0
+        self.coalesced = 0
+
+    # ---------- الإرسال ----------
+
+    def submit(self, method, chat_id, priority=NORMAL, coalesce_key=None, merge=join_texts, **kwargs):
+        """إضافة استدعاء bot.<method>(chat_id=..., **kwargs) للطابور، ويعيد Future بنتيجته.
+
+        merge(old_kwargs, new_kwargs) يعيد الوسائط المدمجة، أو None إذا لا يمكن الدمج (مثل تجاوز
+        حد الطول) فتبدأ رسالة جديدة تُدمج فيها الرسائل التالية.
+        """
+        if coalesce_key is not None:
+            pending = self._coalescing.get(coalesce_key)
+            if pending is not None and pending.merged < self.max_merged:
+                merged = merge(pending.kwargs, kwargs)
+                if merged is not None:
+                    pending.kwargs = merged
+                    pending.merged += 1
+                    self.coalesced += 1
+                    return pending.future
+
+        future = asyncio.get_running_loop().create_future()
+        job = _Job(method, chat_id, kwargs, priority, next(self._seq), future, coalesce_key, merge)
+        if coalesce_key is not None:
+            self._coalescing[coalesce_key] = job
+        heapq.heappush(self._ready, job)
+        self._wakeup.set()
+        return future
+
+    def send_message(self, chat_id, text, priority=NORMAL, coalesce_key=None, **kwargs):
+        return self.submit('send_message', chat_id, priority, coalesce_key, text=text, **kwargs)
+
+    def pending(self):
+        return len(self._ready) + len(self._delayed) + len(self._inflight)
+
+    # ---------- التشغيل والإيقاف ----------
+
+    def start(self, bot):
+        self._bot = bot
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self, drain_timeout=10.0):
+        """إرسال ما تبقى في الطابور وانتظار الاستدعاءات الجارية (حتى drain_timeout ثانية) ثم إيقاف العامل.
+        يجب استدعاؤها والبوت ما زال مفتوحًا (post_stop، لا post_shutdown)."""
+        deadline = time.monotonic() + drain_timeout
+        while self.pending() and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        for task in list(self._inflight):
+            task.cancel()
+        await asyncio.gather(*self._inflight, return_exceptions=True)
+        for job in self._ready + [job for _, job in self._delayed]:
+            if not job.future.done():
+                job.future.cancel()
+
+    # ---------- العامل ----------
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            bucket = self._chats[chat_id] = TokenBucket(self.per_chat_rate, self.per_chat_burst)
+        return bucket
+
+    async def _run(self):
+        while True:
+            now = time.monotonic()
+            while self._delayed and self._delayed[0][0] <= now:
+                heapq.heappush(self._ready, heapq.heappop(self._delayed)[1])
+
+            if not self._ready:
+                self._wakeup.clear()
+                timeout = self._delayed[0][0] - now if self._delayed else None
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            wait = max(self._paused_until - now, self._global.wait_time(now))
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+
+            job = heapq.heappop(self._ready)
+            # حد المجموعة يخص رسائل المجموعات فقط (chat_id سالب)، ولا يوقف رسائل المجموعات الأخرى
+            if job.chat_id < 0 and job.method.startswith('send_'):
+                chat_wait = self._chat_bucket(job.chat_id).wait_time(now)
+                if chat_wait > 0:
+                    heapq.heappush(self._delayed, (now + chat_wait, job))
+                    continue
+                self._chats[job.chat_id].take()
+            self._global.take()
+
+            if job.coalesce_key is not None and self._coalescing.get(job.coalesce_key) is job:
+                del self._coalescing[job.coalesce_key]
+            task = asyncio.create_task(self._call(job))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _call(self, job):
+        try:
+            result = await getattr(self._bot, job.method)(chat_id=job.chat_id, **job.kwargs)
+        except asyncio.CancelledError:
+            job.future.cancel()
+            raise
+        except Exception as exc:
+            retry_after = getattr(exc, 'retry_after', None)
+            job.attempts += 1
+            if job.attempts <= self.max_retries and (retry_after is not None or self.is_transient(exc)):
+                self.retries += 1
+                now = time.monotonic()
+                if retry_after is not None:
+                    delay = retry_after.total_seconds() if hasattr(retry_after, 'total_seconds') else float(retry_after)
+                    self._paused_until = max(self._paused_until, now + delay)
+                else:
+                    delay = min(30.0, 2 ** (job.attempts - 1))
+                heapq.heappush(self._delayed, (now + delay, job))
+                self._wakeup.set()
+                return
+            self.failed += 1
+            logger.warning("Outbox %s to %s failed: %s", job.method, job.chat_id, exc)
+            job.future.set_exception(exc)
+            job.future.exception()  # لا تحذير إذا لم ينتظر أحد النتيجة
+            return
+        self.sent += 1
+        job.future.set_result(result)
@@ -0,0 +1,73 @@
+import logging
+
+from matcher import normalize_arabic
+
+logger = logging.getLogger(__name__)
+
+
+class MessageContext:
+    """سياق مشترك يُبنى مرة واحدة لكل تحديث وتمر به جميع المراحل."""
+
+    __slots__ = ('update', 'context', 'message', 'chat_id', 'user_id', 'text',
+                 'normalized_text', 'entities', 'settings', '_admin_checker', '_is_admin')
+
+    def __init__(self, update, context, settings, admin_checker):
+        self.update = update
+        self.context = context
+        self.message = update.effective_message
+        self.chat_id = update.effective_chat.id
+        self.user_id = update.effective_user.id if update.effective_user else None
+        self.text = self.message.text or self.message.caption
+        self.normalized_text = normalize_arabic(self.text) if self.text else None
+        self.entities = self.message.entities or self.message.caption_entities or ()
+        self.settings = settings
+        self._admin_checker = admin_checker
+        self._is_admin = None
+
+    async def is_admin(self):
+        """رتبة المرسل (مخصصة أو مشرف تيليجرام)، تُحسب مرة واحدة فقط لكل تحديث"""
+        if self._is_admin is None:
+            self._is_admin = await self._admin_checker(self.update, self.context)
+        return self._is_admin
+
+
+class MessagePipeline:
+    """معالج رسائل واحد يشغل مراحل الفحص بالترتيب بدل عدة معالجات مستقلة.
+
+    كل مرحلة دالة async تستقبل MessageContext وتعيد True إذا حذفت الرسالة أو عاقبت
+    المرسل، فتتوقف المراحل التالية. استثناء في مرحلة يُسجل وتكمل المراحل التالية كما لو
+    كانت معالجات مستقلة (ويُعد في angel_handler_errors_total عبر instrument).
+    """
+
+    def __init__(self, settings_loader, admin_checker):
+        self._settings_loader = settings_loader
+        self._admin_checker = admin_checker
+        self._stages = []
+
+    def add_stage(self, stage, text_only=True):
+        """إضافة مرحلة في نهاية السلسلة (text_only: تعمل فقط على الرسائل التي تحتوي نصًا)"""
+        self._stages.append((stage, text_only))
+        return stage
+
+    def instrument(self, wrap):
+        """استبدال كل مرحلة بـ wrap(stage) (للقياس) مع الإبقاء على ترتيبها وشرط text_only"""
+        self._stages = [(wrap(stage), text_only) for stage, text_only in self._stages]
+
+    @property
+    def stages(self):
+        return [stage for stage, _ in self._stages]
+
+    async def handle(self, update, context):
+        if not update.effective_message or not update.effective_chat or update.effective_chat.type == 'private':
+            return
+
+        settings = await self._settings_loader(update.effective_chat.id)
+        ctx = MessageContext(update, context, settings, self._admin_checker)
+        for stage, text_only in self._stages:
+            if text_only and not ctx.message.text:
+                continue
+            try:
+                if await stage(ctx):
+                    return
+            except Exception:
+                logger.exception("Pipeline stage %s failed in chat %s", getattr(stage, '__qualname__', stage), ctx.chat_id)
@@ -0,0 +1,42 @@
+# بتات نوع المحتوى: كل رسالة تُصنف مرة واحدة إلى مجموعة بتات، وسياسة المجموعة مجموعة
+# بتات الأقفال المفعلة، فقرار الحذف عملية AND واحدة
+LINK, PHOTO, GIF, STICKER, FORWARD, ANY = (1 << bit for bit in range(6))
+
+# نوع القفل -> (عمود groups_settings، بت المحتوى الممنوع)
+LOCKS = {
+    'links': ('lock_links', LINK),
+    'photos': ('lock_photos', PHOTO),
+    'gifs': ('lock_gifs', GIF),
+    'stickers': ('lock_stickers', STICKER),
+    'forward': ('lock_forward', FORWARD),
+    'group': ('group_locked', ANY),  # قفل المجموعة: أي رسالة من غير المشرفين
+}
+
+LINK_ENTITY_TYPES = frozenset({'url', 'text_link'})
+
+
+def compile_policy(settings):
+    """سياسة المجموعة كبتات من أعمدة الأقفال (0 للمجموعات غير المقفلة)"""
+    policy = 0
+    for column, bit in LOCKS.values():
+        if settings.get(column):
+            policy |= bit
+    return policy
+
+
+def classify_message(message, entities=()):
+    """بتات أنواع المحتوى في الرسالة؛ الروابط من كيانات تيليجرام (url, text_link) دون فحص النص"""
+    content = ANY
+    if message.photo:
+        content |= PHOTO
+    if message.animation:
+        content |= GIF
+    if message.sticker:
+        content |= STICKER
+    if getattr(message, 'forward_origin', None) or getattr(message, 'forward_date', None):
+        content |= FORWARD
+    for entity in entities:
+        if entity.type in LINK_ENTITY_TYPES:
+            content |= LINK
+            break
+    return content
@@ -0,0 +1,97 @@
+import time
+from collections import OrderedDict, deque
+
+
+class _ChatJoins:
+    """انضمامات مجموعة واحدة خلال النافذة، وحالة وضع الغارة والدفعة المنتظرة."""
+
+    __slots__ = ('joins', 'total', 'raid_until', 'batch', 'last')
+
+    def __init__(self):
+        self.joins = deque()   # (الوقت، عدد المنضمين)
+        self.total = 0
+        self.raid_until = 0.0
+        self.batch = []
+        self.last = 0.0
+
+
+class JoinRaidDetector:
+    """كشف موجات الانضمام (raid) لكل مجموعة وتجميع المنضمين أثناءها.
+
+    إذا بلغ عدد المنضمين threshold خلال window ثانية تدخل المجموعة وضع الغارة، وتبقى فيه
+    حتى يمر cooldown ثانية دون تجاوز الحد. في هذا الوضع يُضاف المنضمون إلى دفعة تُعالج
+    مرة واحدة كل batch_window ثانية (ترحيب واحد وتقييد جماعي) بدل معالجة كل انضمام وحده.
+    المجموعات الخاملة تُحذف من أقدمها، والعدد الكلي لا يتجاوز max_chats.
+    """
+
+    def __init__(self, threshold=10, window=60.0, cooldown=120.0, batch_window=5.0, max_chats=10000):
+        self.threshold = threshold
+        self.window = window
+        self.cooldown = cooldown
+        self.batch_window = batch_window
+        self.max_chats = max_chats
+        # مرتبة حسب آخر انضمام، فالأقدم دائمًا في البداية
+        self._chats = OrderedDict()
+
+    def record(self, chat_id, count=1, now=None):
+        """تسجيل count منضمين وإرجاع True إذا كانت المجموعة في وضع الغارة"""
+        if now is None:
+            now = time.monotonic()
+        state = self._chats.get(chat_id)
+        if state is None:
+            state = self._chats[chat_id] = _ChatJoins()
+            self._evict(now)
+        else:
+            self._chats.move_to_end(chat_id)
+
+        joins = state.joins
+        cutoff = now - self.window
+        while joins and joins[0][0] <= cutoff:
+            state.total -= joins.popleft()[1]
+        joins.append((now, count))
+        state.total += count
+        state.last = now
+
+        if state.total >= self.threshold:
+            state.raid_until = now + self.cooldown
+        return now < state.raid_until
+
+    def is_raid(self, chat_id, now=None):
+        state = self._chats.get(chat_id)
+        return state is not None and (time.monotonic() if now is None else now) < state.raid_until
+
+    def buffer(self, chat_id, members):
+        """إضافة منضمين إلى دفعة المجموعة؛ يعيد True إذا بدأت دفعة جديدة (يجب جدولة معالجتها)"""
+        state = self._chats.get(chat_id)
+        if state is None:
+            state = self._chats[chat_id] = _ChatJoins()
+        started = not state.batch
+        state.batch.extend(members)
+        return started
+
+    def drain(self, chat_id):
+        """أخذ دفعة المجموعة المنتظرة وتفريغها"""
+        state = self._chats.get(chat_id)
+        if state is None:
+            return []
+        batch, state.batch = state.batch, []
+        return batch
+
+    def _evict(self, now):
+        chats = self._chats
+        cutoff = now - self.window - self.cooldown
+        # المجموعات ذات الدفعة المنتظرة لا تُحذف (وإلا ضاعت انضماماتها)، بل تُنقل للنهاية؛
+        # قد يتجاوز العدد max_chats مؤقتًا إذا كانت جميعها تنتظر دفعة
+        skipped = 0
+        while len(chats) > skipped:
+            chat_id, oldest = next(iter(chats.items()))
+            if oldest.last >= cutoff and len(chats) <= self.max_chats:
+                break
+            if oldest.batch:
+                chats.move_to_end(chat_id)
+                skipped += 1
+                continue
+            chats.popitem(last=False)
+
+    def __len__(self):
+        return len(self._chats)
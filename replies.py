@@ -0,0 +1,181 @@
+import json
+import logging
+import threading
+
+from cache import LRUCache
+from matcher import normalize_arabic
+
+logger = logging.getLogger(__name__)
+
+GLOBAL_CHAT_ID = 0
+
+# أنواع الوسائط المقبولة كرد، بالترتيب الذي تُفحص به الرسالة
+MEDIA_TYPES = ('photo', 'video', 'animation', 'voice', 'audio', 'document')
+
+
+def reply_key(keyword):
+    """مفتاح البحث عن الرد: الكلمة بعد التوحيد حتى تتطابق صيغها المختلفة"""
+    return normalize_arabic(keyword.strip())
+
+
+def reply_data_from_message(message):
+    """تحويل رسالة الرد (نص أو وسائط) إلى القاموس المخزن في custom_replies.reply_data"""
+    for media_type in MEDIA_TYPES:
+        media = getattr(message, media_type, None)
+        if media:
+            # الصور تصل كقائمة أحجام، نحتفظ بأكبرها
+            if media_type == 'photo':
+                media = media[-1]
+            return {'type': media_type, 'file_id': media.file_id, 'file_unique_id': media.file_unique_id,
+                    'caption': message.caption}
+    return {'type': 'text', 'text': message.text}
+
+
+class Reply:
+    """رد مخزن بعد فكه مرة واحدة: دالة الإرسال (send_message أو send_<نوع الوسائط>) ووسائطها جاهزة.
+
+    الوسائط تُرسل دائمًا بـ file_id المحفوظ فلا يُعاد رفعها. file_id قد يختلف بين
+    الإرسالات للملف نفسه فلا يُحفظ كلما تغير؛ يُحفظ الرد مرة واحدة فقط لإضافة
+    file_unique_id للردود القديمة (انظر remember_file_unique_id).
+    """
+
+    __slots__ = ('chat_id', 'keyword', 'stored', 'type', 'method', 'kwargs', 'file_unique_id')
+
+    def __init__(self, chat_id, keyword, stored):
+        # stored: نص JSON كما هو في custom_replies.reply_data
+        self.chat_id = chat_id
+        self.keyword = keyword
+        self.stored = stored
+        data = json.loads(stored)
+        if isinstance(data, str):  # ردود نصية قديمة مخزنة كنص فقط
+            data = {'type': 'text', 'text': data}
+        self.type = data.get('type', 'text')
+        self.file_unique_id = data.get('file_unique_id')
+        if self.type == 'text':
+            self.method = 'send_message'
+            self.kwargs = {'text': data['text']}
+        elif self.type in MEDIA_TYPES:
+            self.method = f"send_{self.type}"
+            self.kwargs = {self.type: data['file_id']}
+            if data.get('caption'):
+                self.kwargs['caption'] = data['caption']
+        else:
+            raise ValueError(f"Unknown reply type: {self.type}")
+
+    @property
+    def file_id(self):
+        return self.kwargs.get(self.type) if self.type != 'text' else None
+
+    def to_data(self):
+        """القاموس المخزن في custom_replies.reply_data"""
+        if self.type == 'text':
+            return {'type': 'text', 'text': self.kwargs['text']}
+        return {'type': self.type, 'file_id': self.file_id, 'file_unique_id': self.file_unique_id,
+                'caption': self.kwargs.get('caption')}
+
+    def remember_file_unique_id(self, message):
+        """إضافة file_unique_id (وfile_id الحالي) من الرسالة المرسلة لرد قديم لا يحمله.
+
+        يعيد نص JSON السابق إذا تغير الرد (ليُحفظ بشرط عدم تعديله منذ تحميله)، وإلا None.
+        """
+        if self.type == 'text' or self.file_unique_id is not None:
+            return None
+        media = getattr(message, self.type, None)
+        if not media:
+            return None
+        if self.type == 'photo':
+            media = media[-1]
+        previous = self.stored
+        self.file_unique_id = media.file_unique_id
+        # نسخة جديدة حتى لا تتأثر الإرسالات الجارية
+        self.kwargs = dict(self.kwargs, **{self.type: media.file_id})
+        self.stored = json.dumps(self.to_data())
+        return previous
+
+
+# نتيجة peek عندما لا تكون ردود المجموعة محملة في الذاكرة بعد
+NOT_LOADED = object()
+
+
+class ReplyIndex:
+    """فهرس الردود في الذاكرة.
+
+    الردود العامة (chat_id 0) محملة دائمًا، والردود المحلية تُحمل لكل مجموعة
+    باستعلام واحد وتبقى في ذاكرة LRU محدودة بعدد المجموعات، فلا تحتاج الرسائل
+    التي لا تطابق أي كلمة (وهي الغالبية) إلى أي استعلام.
+    """
+
+    def __init__(self, loader, max_chats=1024):
+        # loader(chat_id) -> {keyword: نص JSON من reply_data}
+        self._loader = loader
+        self._chats = LRUCache(maxsize=max_chats, ttl=float('inf'))
+        self._global_lock = threading.Lock()
+        self._global = None
+
+    @staticmethod
+    def _index(chat_id, rows):
+        # فك JSON وبناء كائنات Reply مرة واحدة عند التحميل، لا عند كل رد. الصف التالف يُتجاهل
+        # وحده، وإلا فشل تحميل ردود المجموعة كلها (وللردود العامة: كل رسالة في كل مجموعة)
+        entries = {}
+        for keyword, stored in rows.items():
+            try:
+                entries[reply_key(keyword)] = Reply(chat_id, keyword, stored)
+            except (ValueError, TypeError, KeyError, AttributeError) as e:
+                logger.warning("Skipping malformed reply %r in chat %s: %r", keyword, chat_id, e)
+        return entries
+
+    def get(self, chat_id, keyword):
+        """الرد المحلي المطابق للكلمة في المجموعة (Reply)، أو None"""
+        entries = self._chats.get(chat_id)
+        if entries is None:
+            generation = self._chats.generation
+            entries = self._index(chat_id, self._loader(chat_id))
+            self._chats.set(chat_id, entries, generation)
+        return entries.get(reply_key(keyword))
+
+    def get_global(self, keyword):
+        """الرد العام المطابق للكلمة (Reply)، أو None"""
+        entries = self._global
+        if entries is None:
+            with self._global_lock:
+                if self._global is None:
+                    self._global = self._index(GLOBAL_CHAT_ID, self._loader(GLOBAL_CHAT_ID))
+                entries = self._global
+        return entries.get(reply_key(keyword))
+
+    def peek(self, chat_id, keyword):
+        """مثل get/get_global دون تحميل من قاعدة البيانات: NOT_LOADED إن لم تكن الردود في الذاكرة"""
+        entries = self._global if chat_id == GLOBAL_CHAT_ID else self._chats.get(chat_id)
+        if entries is None:
+            return NOT_LOADED
+        return entries.get(reply_key(keyword))
+
+    def on_reply_saved(self, chat_id, keyword, stored):
+        """تحديث الفهرس بعد حفظ رد جديد في قاعدة البيانات"""
+        if chat_id == GLOBAL_CHAT_ID:
+            with self._global_lock:
+                if self._global is not None:
+                    # نسخة جديدة حتى لا تتأثر القراءات الجارية
+                    entries = dict(self._global)
+                    entries[reply_key(keyword)] = Reply(chat_id, keyword, stored)
+                    self._global = entries
+        else:
+            self._chats.invalidate(chat_id)
+
+    def hot_state(self):
+        """الردود المحملة حاليًا (العامة ولكل مجموعة) لحفظها في لقطة عند الإيقاف"""
+        return {'global': self._global, 'chats': self._chats.items()}
+
+    def restore_hot_state(self, state):
+        with self._global_lock:
+            if self._global is None:
+                self._global = state['global']
+        self._chats.load(state['chats'])
+
+    def reload_global(self):
+        """إسقاط الردود العامة لتُحمل من جديد عند أول طلب (عند إضافتها من عملية أخرى)"""
+        with self._global_lock:
+            self._global = None
+
+    def stats(self):
+        return self._chats.stats()
@@ -0,0 +1,137 @@
+import asyncio
+import heapq
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class PunishmentScheduler:
+    """جدولة رفع العقوبات المؤقتة (الكتم) في وقتها بالضبط.
+
+    تحتفظ بكومة صغرى (min-heap) للعقوبات التي تنتهي خلال horizon ثانية فقط، وتُحمل
+    النافذة التالية من الفهرس idx_punishments_until دون مسح الجدول. عند الاستحقاق
+    تُرفع جميع العقوبات المستحقة معًا (خلال batch_window ثانية)، ولا يُحذف صف العقوبة إلا
+    بعد رفعها بنجاح، فالانهيار قبل ذلك يترك الصف ليُرفع عند التشغيل التالي.
+    العقوبات التي انتهت أثناء توقف البوت تُرفع فور التشغيل.
+    """
+
+    def __init__(self, db, lift, horizon=3600, batch_window=1.0, retry_delay=30, owns=None):
+        # lift(chat_id, user_id, type) -> True إذا رُفعت العقوبة، False لإعادة المحاولة لاحقًا
+        self._db = db
+        self._lift = lift
+        # owns(chat_id) -> False للمجموعات التي تتولاها عملية أخرى (وضع العمال المتعددين)
+        self.owns = owns
+        self.horizon = horizon
+        self.batch_window = batch_window
+        self.retry_delay = retry_delay
+        # الكومة: (موعد التنفيذ، until_ts، chat_id، user_id، النوع)؛ موعد التنفيذ يتأخر
+        # عند إعادة المحاولة. العناصر التي لا تطابق _scheduled (جُددت أو أُزيلت) تُتجاهل عند خروجها
+        self._heap = []
+        # (chat_id, user_id, النوع) -> until_ts المجدول حاليًا
+        self._scheduled = {}
+        self._loaded_until = -1
+        self._job_queue = None
+        self._job = None
+        self._job_due = None
+
+    async def start(self, job_queue):
+        """تحميل العقوبات المستحقة قريبًا (والمنتهية أثناء التوقف) وجدولة أقربها"""
+        self._job_queue = job_queue
+        await self._refill()
+        job_queue.run_repeating(self._refill_job, interval=self.horizon / 2, first=self.horizon / 2)
+
+    def add(self, chat_id, user_id, punishment_type, until_ts):
+        """تسجيل عقوبة جديدة أو مجددة (بعد حفظها في قاعدة البيانات)؛ until_ts = None للعقوبة الدائمة.
+        تحل محل أي موعد سابق للعضو نفسه."""
+        key = (chat_id, user_id, punishment_type)
+        if until_ts is None or until_ts > self._loaded_until:
+            # دائمة أو خارج النافذة المحملة (تُحمل لاحقًا من الفهرس)
+            self._scheduled.pop(key, None)
+            return
+        self._push(until_ts, until_ts, chat_id, user_id, punishment_type)
+        self._reschedule()
+
+    def remove(self, chat_id, user_id, punishment_type):
+        """إلغاء الموعد المجدول بعد رفع العقوبة يدويًا (بعد حذفها من قاعدة البيانات)"""
+        self._scheduled.pop((chat_id, user_id, punishment_type), None)
+
+    def __len__(self):
+        return len(self._scheduled)
+
+    def _push(self, due, until_ts, chat_id, user_id, punishment_type, retry=False):
+        key = (chat_id, user_id, punishment_type)
+        # العقوبة نفسها قد تصل مرتين (تحميل + add)، فلا تُضاف للكومة مرة ثانية
+        if not retry and self._scheduled.get(key) == until_ts:
+            return
+        self._scheduled[key] = until_ts
+        heapq.heappush(self._heap, (due, until_ts, chat_id, user_id, punishment_type))
+
+    async def _refill(self):
+        horizon = int(time.time()) + self.horizon
+        rows = await self._db.get_expiring_punishments(self._loaded_until, horizon)
+        for chat_id, user_id, punishment_type, until_ts in rows:
+            if self.owns is not None and not self.owns(chat_id):
+                continue
+            self._push(until_ts, until_ts, chat_id, user_id, punishment_type)
+        self._loaded_until = horizon
+        self._reschedule()
+
+    async def _refill_job(self, context):
+        await self._refill()
+
+    def _reschedule(self):
+        """جدولة مهمة واحدة في JobQueue لموعد أقرب عقوبة"""
+        if self._job_queue is None or not self._heap:
+            return
+        due = self._heap[0][0]
+        if self._job is not None:
+            if self._job_due <= due:
+                return
+            self._job.schedule_removal()
+        self._job_due = due
+        self._job = self._job_queue.run_once(self._fire, when=max(0, due - time.time()))
+
+    def _current(self, chat_id, user_id, punishment_type, until_ts):
+        return self._scheduled.get((chat_id, user_id, punishment_type)) == until_ts
+
+    async def _fire(self, context):
+        self._job = None
+        cutoff = time.time() + self.batch_window
+        due = []
+        while self._heap and self._heap[0][0] <= cutoff:
+            _, until_ts, chat_id, user_id, punishment_type = heapq.heappop(self._heap)
+            if self._current(chat_id, user_id, punishment_type, until_ts):
+                due.append((chat_id, user_id, punishment_type, until_ts))
+
+        # لا يُرفع إلا ما بقي محفوظًا بالموعد نفسه: العقوبة التي جُددت أو أصبحت دائمة أو أُزيلت
+        # (ولو من عملية أخرى) بعد جدولتها لا تُرفع مبكرًا
+        batch = await self._db.get_current_punishments(due) if due else []
+        current = set(batch)
+        for key in due:
+            if key not in current and self._current(*key):
+                self._scheduled.pop(key[:3])
+
+        if batch:
+            results = await asyncio.gather(
+                *(self._lift(chat_id, user_id, punishment_type) for chat_id, user_id, punishment_type, _ in batch),
+                return_exceptions=True,
+            )
+            lifted = []
+            for key, result in zip(batch, results):
+                chat_id, user_id, punishment_type, until_ts = key
+                if result is True:
+                    lifted.append(key)
+                    continue
+                if isinstance(result, BaseException):
+                    logger.warning("Failed to lift %s for %s in %s: %s", punishment_type, user_id, chat_id, result)
+                if self._current(*key):
+                    self._push(time.time() + self.retry_delay, until_ts, chat_id, user_id, punishment_type, retry=True)
+            # الحذف بعد الرفع فقط، ومشروط بـ until_ts كي لا تُحذف عقوبة جُددت أثناء الرفع
+            if lifted:
+                await self._db.remove_expired_punishments(lifted)
+                for key in lifted:
+                    if self._current(*key):
+                        del self._scheduled[key[:3]]
+
+        self._reschedule()
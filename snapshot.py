@@ -0,0 +1,63 @@
+import logging
+import mmap
+import os
+import pickle
+import time
+
+logger = logging.getLogger(__name__)
+
+# يتغير عند تغيير بنية اللقطة، فتُتجاهل اللقطات القديمة
+SNAPSHOT_FORMAT = 3
+
+
+def _db_identity(db_path):
+    # ملف قاعدة بيانات آخر (حُذف وأُعيد إنشاؤه أو استُبدل) لا تصلح له لقطة الملف القديم
+    try:
+        st = os.stat(db_path)
+    except OSError:
+        return None
+    return st.st_dev, st.st_ino
+
+
+def write_snapshot(path, state, db_path, schema_version):
+    """كتابة الحالة الساخنة (ذاكرة مؤقتة جاهزة) عند الإيقاف؛ الكتابة لملف مؤقت ثم إعادة تسمية"""
+    snapshot = {
+        'format': SNAPSHOT_FORMAT,
+        'schema': schema_version,
+        'db': _db_identity(db_path),
+        'written_at': time.time(),
+        'state': state,
+    }
+    tmp = f"{path}.tmp"
+    with open(tmp, 'wb') as f:
+        pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, path)
+
+
+def read_snapshot(path, db_path, schema_version, max_age):
+    """قراءة لقطة write_snapshot عبر mmap ثم حذفها، أو None إن لم توجد أو لم تعد صالحة.
+
+    اللقطة تُستهلك مرة واحدة: إذا توقفت العملية دون كتابة لقطة جديدة (انهيار) لا تُحمل
+    لقطة أقدم من تعديلات قاعدة البيانات بعدها.
+    """
+    try:
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            snapshot = pickle.loads(data)
+    except FileNotFoundError:
+        return None
+    except Exception:
+        logger.warning("Ignoring unreadable hot-state snapshot %s", path, exc_info=True)
+        snapshot = None
+    finally:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    if not isinstance(snapshot, dict) or snapshot.get('format') != SNAPSHOT_FORMAT:
+        return None
+    age = time.time() - snapshot['written_at']
+    if snapshot['schema'] != schema_version or snapshot['db'] != _db_identity(db_path) or not 0 <= age <= max_age:
+        logger.info("Discarding stale hot-state snapshot %s (age %.0fs)", path, age)
+        return None
+    return snapshot['state']
@@ -0,0 +1,44 @@
+import os
+import sys
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cache import LRUCache  # noqa: E402
+
+
+class SnapshotTtlTest(unittest.TestCase):
+    """العناصر المستعادة من لقطة تحتفظ بما بقي من صلاحيتها"""
+
+    def test_load_keeps_remaining_ttl(self):
+        cache = LRUCache(ttl=100.0)
+        cache.set('a', 1)
+        items = cache.items()
+        restored = LRUCache(ttl=100.0)
+        with mock.patch('time.time', return_value=time.time() + 90):
+            restored.load(items)
+        expires_at, value = restored._data['a']
+        self.assertEqual(value, 1)
+        self.assertLessEqual(expires_at - time.monotonic(), 10.0)
+
+    def test_load_skips_entries_expired_while_stopped(self):
+        cache = LRUCache(ttl=100.0)
+        cache.set('a', 1)
+        items = cache.items()
+        restored = LRUCache(ttl=100.0)
+        with mock.patch('time.time', return_value=time.time() + 101):
+            restored.load(items)
+        self.assertEqual(len(restored), 0)
+
+    def test_infinite_ttl_survives_snapshot(self):
+        cache = LRUCache(ttl=float('inf'))
+        cache.set('a', 1)
+        restored = LRUCache(ttl=float('inf'))
+        restored.load(cache.items())
+        self.assertEqual(restored.get('a'), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,36 @@
+import asyncio
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from outbox import COSMETIC, MAX_TEXT_LENGTH, Outbox  # noqa: E402
+
+
+class CoalesceCapTest(unittest.TestCase):
+    """الرسائل المدمجة لا تتجاوز max_merged ولا حد طول تيليجرام"""
+
+    def submit_all(self, outbox, texts):
+        async def run():
+            return [outbox.send_message(-1, text, priority=COSMETIC, coalesce_key=('left', -1)) for text in texts]
+        return asyncio.run(run())
+
+    def test_count_cap_starts_new_message(self):
+        outbox = Outbox(max_merged=3)
+        futures = self.submit_all(outbox, [f"line {i}" for i in range(10)])
+        self.assertEqual(outbox.pending(), 3)
+        self.assertIs(futures[0], futures[3])
+        self.assertIsNot(futures[3], futures[4])
+        self.assertEqual(outbox._ready[0].kwargs['text'].count('\n'), 3)
+
+    def test_length_cap_starts_new_message(self):
+        outbox = Outbox(max_merged=1000)
+        self.submit_all(outbox, ['x' * 1000] * 10)
+        self.assertGreater(outbox.pending(), 1)
+        for job in outbox._ready:
+            self.assertLessEqual(len(job.kwargs['text']), MAX_TEXT_LENGTH)
+
+
+if __name__ == '__main__':
+    unittest.main()
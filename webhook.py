@@ -0,0 +1,119 @@
+import asyncio
+import json
+import logging
+import signal
+
+import tornado.httpserver
+import tornado.web
+from telegram import Update
+from telegram.ext import Application, ConversationHandler
+
+logger = logging.getLogger(__name__)
+
+# نوع التحديث لتسمية مقياس زمن المعالجة
+UPDATE_KINDS = ('message', 'edited_message', 'callback_query', 'chat_member', 'my_chat_member',
+                'chat_join_request', 'inline_query')
+
+
+def update_kind(update):
+    return next((kind for kind in UPDATE_KINDS if getattr(update, kind, None) is not None), 'other')
+
+
+class InstrumentedApplication(Application):
+    """Application يقيس زمن كل تحديث عبر جميع مجموعات المعالجات، ويأخذ عينات من التحديثات البطيئة."""
+
+    def __init__(self, *, metrics, profiler=None, **kwargs):
+        super().__init__(**kwargs)
+        self.metrics = metrics
+        self.profiler = profiler
+
+    async def process_update(self, update):
+        kind = update_kind(update) if isinstance(update, Update) else type(update).__name__
+        if self.profiler is not None:
+            self.profiler.begin()
+        start = asyncio.get_running_loop().time()
+        try:
+            await super().process_update(update)
+        finally:
+            self.metrics.updates.observe(kind, asyncio.get_running_loop().time() - start)
+            if self.profiler is not None and self.profiler.end(kind) is not None:
+                self.metrics.slow_updates.inc()
+
+
+def instrument_handlers(application, metrics):
+    """تغليف كل معالج مسجل (بما فيها معالجات داخل ConversationHandler) لقياس زمنه وأخطائه"""
+    def wrap(handler):
+        if isinstance(handler, ConversationHandler):
+            for child in handler.entry_points + handler.fallbacks + [h for hs in handler.states.values() for h in hs]:
+                wrap(child)
+        elif getattr(handler, 'callback', None) is not None:
+            handler.callback = metrics.instrument(handler.callback)
+
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            wrap(handler)
+
+
+class _WebhookHandler(tornado.web.RequestHandler):
+    def initialize(self, application, secret_token):
+        self.bot_application = application
+        self.secret_token = secret_token
+
+    async def post(self):
+        if self.secret_token and self.request.headers.get('X-Telegram-Bot-Api-Secret-Token') != self.secret_token:
+            raise tornado.web.HTTPError(403)
+        try:
+            data = json.loads(self.request.body)
+        except ValueError:
+            raise tornado.web.HTTPError(400)
+        await self.bot_application.update_queue.put(Update.de_json(data, self.bot_application.bot))
+        self.set_status(200)
+
+    def log_exception(self, typ, value, tb):
+        logger.error("Webhook request failed", exc_info=(typ, value, tb))
+
+
+class _MetricsHandler(tornado.web.RequestHandler):
+    def initialize(self, metrics):
+        self.metrics = metrics
+
+    def get(self):
+        self.set_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.write(self.metrics.render())
+
+
+async def serve_webhook(application, metrics, listen, port, url_path, webhook_url,
+                        allowed_updates=None, secret_token=None):
+    """بديل run_webhook: خادم واحد على المنفذ نفسه للـ Webhook ولمسار /metrics.
+
+    يتبع ترتيب run_webhook: initialize ثم post_init ثم setWebhook ثم start، وعند
+    SIGINT/SIGTERM يوقف الخادم ثم stop وshutdown وpost_shutdown.
+    """
+    webhook_path = f"/{url_path.strip('/')}" if url_path.strip('/') else "/"
+    web_app = tornado.web.Application([
+        (r"/metrics", _MetricsHandler, {'metrics': metrics}),
+        (webhook_path, _WebhookHandler, {'application': application, 'secret_token': secret_token}),
+    ])
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await application.bot.set_webhook(url=webhook_url, allowed_updates=allowed_updates, secret_token=secret_token)
+    await application.start()
+    server = tornado.httpserver.HTTPServer(web_app)
+    server.listen(port, address=listen)
+    logger.info(f"Serving webhook and /metrics on {listen}:{port}")
+    try:
+        await stop.wait()
+    finally:
+        server.stop()
+        await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
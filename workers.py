@@ -0,0 +1,238 @@
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+
+import tornado.httpserver
+import tornado.web
+from telegram import Bot, Update
+
+from metrics import Metrics, merge_expositions
+
+logger = logging.getLogger(__name__)
+
+# أنواع التحديثات التي تحمل المحادثة مباشرة أو داخل رسالة
+_CHAT_UPDATES = ('message', 'edited_message', 'channel_post', 'edited_channel_post', 'my_chat_member',
+                 'chat_member', 'chat_join_request', 'message_reaction', 'message_reaction_count', 'chat_boost')
+
+
+def update_chat_id(data):
+    """معرف المحادثة من JSON التحديث الخام دون بناء كائن Update (أو معرف المستخدم إن لم توجد محادثة)"""
+    for key in _CHAT_UPDATES:
+        item = data.get(key)
+        if item is not None and 'chat' in item:
+            return item['chat']['id']
+    callback = data.get('callback_query')
+    if callback is not None:
+        message = callback.get('message')
+        return message['chat']['id'] if message else callback['from']['id']
+    for item in data.values():
+        if isinstance(item, dict) and 'from' in item:
+            return item['from']['id']
+    return 0
+
+
+def shard_for(chat_id, workers):
+    """العامل المسؤول عن المحادثة: ثابت بين العمليات والتشغيلات، فيبقى ترتيب تحديثات كل محادثة"""
+    return chat_id % workers
+
+
+# ---------- العامل ----------
+
+def worker_main(index, count, token, updates, metrics_out, build_application, configure_worker, metrics_interval=5.0):
+    """نقطة دخول كل عملية عامل: تطبيق كامل (معالجات، قاعدة بيانات، طابور إرسال) لجزء من المحادثات.
+
+    build_application وconfigure_worker تُمرران من main حتى تستورد العملية الجديدة main مرة واحدة.
+    """
+    # الإيقاف تنسقه العملية الرئيسية عبر رسالة None في طابور التحديثات
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    metrics = configure_worker(index, count)
+    asyncio.run(_run_worker(index, token, updates, metrics_out, build_application, metrics, metrics_interval))
+
+
+async def _run_worker(index, token, updates, metrics_out, build_application, metrics, metrics_interval):
+    application = build_application(token)
+    loop = asyncio.get_running_loop()
+    finished = asyncio.Event()
+
+    def enqueue(body):
+        application.update_queue.put_nowait(Update.de_json(json.loads(body), application.bot))
+
+    def read_updates():
+        parent = os.getppid()
+        while True:
+            try:
+                body = updates.get(timeout=1.0)
+            except queue.Empty:
+                if os.getppid() != parent:
+                    logger.error("Worker %s: receiver process exited, shutting down", index)
+                    break
+                continue
+            if body is None:
+                break
+            loop.call_soon_threadsafe(enqueue, body)
+        loop.call_soon_threadsafe(finished.set)
+
+    async def push_metrics(context):
+        metrics_out.put((index, metrics.render()))
+
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    application.job_queue.run_repeating(push_metrics, interval=metrics_interval, first=0)
+    await application.start()
+    threading.Thread(target=read_updates, name='update-reader', daemon=True).start()
+    logger.info("Worker %s started (pid %s)", index, os.getpid())
+
+    await finished.wait()
+    # stop() ينهي معالجة التحديثات المتبقية في update_queue قبل الإيقاف
+    await application.stop()
+    if application.post_stop:
+        await application.post_stop(application)
+    await application.shutdown()
+    if application.post_shutdown:
+        await application.post_shutdown(application)
+    metrics_out.put((index, metrics.render()))
+    logger.info("Worker %s drained and stopped", index)
+
+
+# ---------- المستقبل ----------
+
+class _ShardingWebhookHandler(tornado.web.RequestHandler):
+    def initialize(self, receiver):
+        self.receiver = receiver
+
+    def post(self):
+        receiver = self.receiver
+        if receiver.secret_token and self.request.headers.get('X-Telegram-Bot-Api-Secret-Token') != receiver.secret_token:
+            raise tornado.web.HTTPError(403)
+        try:
+            chat_id = update_chat_id(json.loads(self.request.body))
+        except (ValueError, KeyError, TypeError):
+            raise tornado.web.HTTPError(400)
+        index = shard_for(chat_id, len(receiver.workers))
+        if not receiver.workers[index].is_alive():
+            # تيليجرام يعيد إرسال التحديث لاحقًا بدل فقدانه
+            logger.error("Worker %s is not running; rejecting update for chat %s", index, chat_id)
+            raise tornado.web.HTTPError(503)
+        receiver.queues[index].put(self.request.body)
+        receiver.routed.inc(index)
+        self.set_status(200)
+
+
+class _MergedMetricsHandler(tornado.web.RequestHandler):
+    def initialize(self, receiver):
+        self.receiver = receiver
+
+    def get(self):
+        self.set_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.write(self.receiver.render_metrics())
+
+
+class ShardedReceiver:
+    """مستقبل الـ Webhook في وضع العمال المتعددين.
+
+    يقرأ chat_id فقط من كل تحديث ويرسله كما هو إلى طابور العامل shard_for(chat_id)،
+    فتُعالج تحديثات كل محادثة بالترتيب في عملية واحدة (حالة ConversationHandler محلية
+    لكل عامل)، بينما تعمل المحادثات المختلفة على أنوية مختلفة. /metrics يدمج آخر لقطة
+    أرسلها كل عامل.
+
+    الإيقاف (SIGINT/SIGTERM): إيقاف استقبال الطلبات، ثم None في طابور كل عامل، فيُنهي
+    العامل ما وصله بالفعل ويكتب بياناته ويتوقف؛ ومن يتجاوز drain_timeout يُنهى قسرًا.
+    العامل الذي يتوقف قبل ذلك (انهيار) يُعاد تشغيله بالرقم والطابور نفسيهما، فيكمل ما بقي فيه.
+    """
+
+    def __init__(self, token, workers, build_application, configure_worker, secret_token=None, drain_timeout=30.0):
+        self.token = token
+        self.secret_token = secret_token
+        self.drain_timeout = drain_timeout
+        self.build_application = build_application
+        self.configure_worker = configure_worker
+        self._context = multiprocessing.get_context('spawn')
+        self.queues = [self._context.Queue() for _ in range(workers)]
+        self.metrics_in = self._context.Queue()
+        self.workers = [self._new_worker(index) for index in range(workers)]
+        self.metrics = Metrics()
+        self.routed = self.metrics.counter('webhook_routed_total', 'Updates routed to each worker', 'worker')
+        self.restarts = self.metrics.counter('worker_restarts_total', 'Workers restarted after exiting unexpectedly', 'worker')
+        self._snapshots = {}
+        self._stopping = False
+
+    def _new_worker(self, index):
+        return self._context.Process(target=worker_main, name=f'bot-worker-{index}', daemon=False,
+                                     args=(index, len(self.queues), self.token, self.queues[index], self.metrics_in,
+                                           self.build_application, self.configure_worker))
+
+    def _supervise(self):
+        """إعادة تشغيل العمال الذين توقفوا خارج الإيقاف المنظم"""
+        for index, process in enumerate(self.workers):
+            if self._stopping or process.is_alive():
+                continue
+            logger.error("Worker %s exited with code %s; restarting", process.name, process.exitcode)
+            process.join()
+            worker = self._new_worker(index)
+            worker.start()
+            self.workers[index] = worker
+            self.restarts.inc(index)
+
+    def _collect_snapshots(self):
+        while True:
+            try:
+                index, text = self.metrics_in.get_nowait()
+            except queue.Empty:
+                return
+            self._snapshots[index] = text
+
+    async def _collect_periodically(self, interval=5.0):
+        # تفريغ اللقطات باستمرار حتى لا تتراكم في الطابور إذا لم يُطلب /metrics، ومراقبة العمال
+        while True:
+            await asyncio.sleep(interval)
+            self._collect_snapshots()
+            self._supervise()
+
+    def render_metrics(self):
+        self._collect_snapshots()
+        return merge_expositions([self.metrics.render()] + [self._snapshots[i] for i in sorted(self._snapshots)])
+
+    async def serve(self, listen, port, url_path, webhook_url, allowed_updates=None):
+        for process in self.workers:
+            process.start()
+        webhook_path = f"/{url_path.strip('/')}" if url_path.strip('/') else "/"
+        web_app = tornado.web.Application([
+            (r"/metrics", _MergedMetricsHandler, {'receiver': self}),
+            (webhook_path, _ShardingWebhookHandler, {'receiver': self}),
+        ])
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+
+        server = tornado.httpserver.HTTPServer(web_app)
+        server.listen(port, address=listen)
+        async with Bot(self.token) as bot:
+            await bot.set_webhook(url=webhook_url, allowed_updates=allowed_updates, secret_token=self.secret_token)
+        logger.info(f"Routing webhook updates on {listen}:{port} to {len(self.workers)} workers")
+        collector = loop.create_task(self._collect_periodically())
+        try:
+            await stop.wait()
+        finally:
+            server.stop()
+            collector.cancel()
+            await loop.run_in_executor(None, self.drain)
+
+    def drain(self):
+        """إرسال إشارة الإيقاف لكل عامل وانتظار تفريغ طوابيرهم"""
+        self._stopping = True
+        for updates in self.queues:
+            updates.put(None)
+        for process in self.workers:
+            process.join(self.drain_timeout)
+            if process.is_alive():
+                logger.error("Worker %s did not drain within %ss; terminating", process.name, self.drain_timeout)
+                process.terminate()
+                process.join()